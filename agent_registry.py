@@ -0,0 +1,71 @@
+import importlib
+import threading
+
+from metrics import instrument_agent
+
+
+def resolve(value):
+    # "module:attribute" strings in agent specs are imported when the agent is built
+    if isinstance(value, str) and ":" in value:
+        module_name, attribute = value.split(":", 1)
+        return getattr(importlib.import_module(module_name), attribute)
+    return value
+
+
+class AgentRegistry:
+    """Builds the autogen agents of a bot from config, on first use.
+
+    specs maps an agent name to its config:
+        system_message, model: required
+        response_format: optional, a pydantic model or "module:Model"
+        functions: optional, list of functions for the agent
+    autogen itself is only imported when the first agent is built, so a bot
+    that has not needed an agent yet starts without loading it.
+    base_url points the agents at another OpenAI compatible endpoint, e.g. the
+    stub LLM of the benchmarks.
+    """
+
+    def __init__(self, specs, api_key, base_url=None):
+        self.specs = specs
+        self.api_key = api_key
+        self.base_url = base_url
+        self._agents = {}
+        self._lock = threading.Lock()
+
+    def llm_config(self, name):
+        spec = self.specs[name]
+        config = {"model": spec["model"], "api_key": self.api_key}
+        if self.base_url:
+            config["base_url"] = self.base_url
+        if "response_format" in spec:
+            config["response_format"] = resolve(spec["response_format"])
+        return {"config_list": [config]}
+
+    def build(self, name):
+        """A new agent, for chats that must not share state with other jobs."""
+        from autogen import ConversableAgent
+
+        spec = self.specs[name]
+        kwargs = {}
+        if "functions" in spec:
+            kwargs["functions"] = spec["functions"]
+        agent = ConversableAgent(
+            name=name,
+            system_message=spec["system_message"],
+            llm_config=self.llm_config(name),
+            **kwargs,
+        )
+        return instrument_agent(agent)
+
+    def get(self, name):
+        """The shared agent of this name, built the first time it is asked for."""
+        agent = self._agents.get(name)
+        if agent is None:
+            with self._lock:
+                agent = self._agents.get(name)
+                if agent is None:
+                    agent = self._agents[name] = self.build(name)
+        return agent
+
+    def built(self):
+        return list(self._agents)
@@ -0,0 +1,231 @@
+import array
+import bisect
+import mmap
+import struct
+import sys
+from datetime import datetime, timedelta, timezone
+
+from data_definition import MessageRecord
+
+# Columnar archive of channel history, see write_archive for the layout.
+# The reader memory-maps the file and only decodes the rows it returns, so
+# opening a multi-year export is instant and lookups by id, time range or
+# thread do not parse the whole file.
+
+MAGIC = b"DCHA"
+VERSION = 1
+
+# column name, array typecode
+COLUMNS = (
+    ("ids", "Q"),  # message id
+    ("timestamps", "q"),  # created_at, microseconds since epoch
+    ("authors", "I"),  # string index
+    ("channels", "I"),  # string index of guild_channel
+    ("guild_ids", "Q"),
+    ("channel_ids", "Q"),
+    ("reply_to", "Q"),  # replied-to message id, 0 if none
+    ("thread_roots", "Q"),  # original_thread_id, 0 if unknown
+    ("flags", "B"),  # FLAG_* bits
+    ("content_offsets", "Q"),  # rows + 1 offsets into content_blob
+    ("content_blob", "B"),
+    ("string_offsets", "Q"),  # strings + 1 offsets into string_blob
+    ("string_blob", "B"),
+    ("id_order", "I"),  # row numbers sorted by message id
+    ("thread_order_roots", "Q"),  # thread_roots sorted
+    ("thread_order_rows", "I"),  # row numbers in thread_order_roots order
+)
+COLUMN_NAMES = [name for name, _ in COLUMNS]
+TYPECODES = dict(COLUMNS)
+
+# magic, version, row count, string count, then (offset, byte length) per column
+HEADER = struct.Struct("<4sIQQ" + "QQ" * len(COLUMNS))
+
+FLAG_REPLY = 1
+FLAG_AUTHOR_BOT = 2
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def timestamp_to_micros(timestamp):
+    created_at = datetime.fromisoformat(timestamp)
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)  # discord times are utc
+    return (created_at - EPOCH) // timedelta(microseconds=1)
+
+
+def micros_to_timestamp(micros):
+    # same format as str(message.created_at)
+    return str(EPOCH + timedelta(microseconds=micros))
+
+
+def _native(column):
+    # the file is little-endian
+    if sys.byteorder != "little":
+        column.byteswap()
+    return column
+
+
+def write_archive(path, msg_list):
+    """Writes download_channel_history records to a columnar archive.
+
+    Rows are stored oldest first. Repeated author and channel strings are
+    interned into one string table, message contents go into one blob indexed
+    by a fixed-width offset column.
+    """
+    msgs = sorted(msg_list, key=lambda msg: (timestamp_to_micros(msg.timestamp), msg.id))
+    strings = {}
+
+    def intern(value):
+        index = strings.get(value)
+        if index is None:
+            index = strings[value] = len(strings)
+        return index
+
+    columns = {name: array.array(typecode) for name, typecode in COLUMNS}
+    content = bytearray()
+    columns["content_offsets"].append(0)
+    for msg in msgs:
+        columns["ids"].append(msg.id)
+        columns["timestamps"].append(timestamp_to_micros(msg.timestamp))
+        columns["authors"].append(intern(msg.author))
+        columns["channels"].append(intern(msg.guild_channel))
+        columns["guild_ids"].append(msg.guild_id)
+        columns["channel_ids"].append(msg.channel_id)
+        columns["reply_to"].append(msg.reply_to_message_id or 0)
+        columns["thread_roots"].append(msg.original_thread_id or 0)
+        columns["flags"].append((FLAG_REPLY if msg.is_reply else 0) | (FLAG_AUTHOR_BOT if msg.author_is_bot else 0))
+        content += msg.content.encode("utf-8")
+        columns["content_offsets"].append(len(content))
+    columns["content_blob"] = array.array("B", content)
+
+    string_blob = bytearray()
+    columns["string_offsets"].append(0)
+    for value in strings:  # dicts keep insertion order, which is the index
+        string_blob += value.encode("utf-8")
+        columns["string_offsets"].append(len(string_blob))
+    columns["string_blob"] = array.array("B", string_blob)
+
+    ids = columns["ids"]
+    columns["id_order"].extend(sorted(range(len(msgs)), key=ids.__getitem__))
+    roots = columns["thread_roots"]
+    thread_rows = sorted(range(len(msgs)), key=lambda row: (roots[row], row))
+    columns["thread_order_rows"].extend(thread_rows)
+    columns["thread_order_roots"].extend(roots[row] for row in thread_rows)
+
+    sections = []
+    offset = HEADER.size
+    for name in COLUMN_NAMES:
+        offset += -offset % 8  # keep every column 8-byte aligned
+        size = len(columns[name]) * columns[name].itemsize
+        sections.append((offset, size))
+        offset += size
+
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(msgs), len(strings), *[value for section in sections for value in section]))
+        for name, (offset, size) in zip(COLUMN_NAMES, sections):
+            f.write(b"\0" * (offset - f.tell()))
+            f.write(_native(columns[name]).tobytes())
+    return len(msgs)
+
+
+class ArchiveReader:
+    """Memory-mapped, random access reader for write_archive files."""
+
+    def __init__(self, path):
+        if sys.byteorder != "little":
+            raise RuntimeError("ArchiveReader needs a little-endian host")
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        header = HEADER.unpack_from(self._mmap)
+        magic, version, self.row_count, self.string_count = header[:4]
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a version {VERSION} history archive")
+        buffer = memoryview(self._mmap)
+        self._columns = {}
+        for index, name in enumerate(COLUMN_NAMES):
+            offset, size = header[4 + 2 * index], header[5 + 2 * index]
+            self._columns[name] = buffer[offset:offset + size].cast(TYPECODES[name])
+        self._strings = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.row_count
+
+    def close(self):
+        # the column views must be released before the map can be closed
+        for column in getattr(self, "_columns", {}).values():
+            column.release()
+        self._columns = {}
+        self._mmap.close()
+        self._file.close()
+
+    def string(self, index):
+        value = self._strings.get(index)
+        if value is None:
+            offsets = self._columns["string_offsets"]
+            value = bytes(self._columns["string_blob"][offsets[index]:offsets[index + 1]]).decode("utf-8")
+            self._strings[index] = value
+        return value
+
+    def row(self, row):
+        """Decodes one row into a MessageRecord."""
+        c = self._columns
+        flags = c["flags"][row]
+        content_offsets = c["content_offsets"]
+        return MessageRecord(
+            id=c["ids"][row],
+            author=self.string(c["authors"][row]),
+            content=bytes(c["content_blob"][content_offsets[row]:content_offsets[row + 1]]).decode("utf-8"),
+            timestamp=micros_to_timestamp(c["timestamps"][row]),
+            guild_id=c["guild_ids"][row],
+            channel_id=c["channel_ids"][row],
+            guild_channel=self.string(c["channels"][row]),
+            is_reply=bool(flags & FLAG_REPLY),
+            author_is_bot=bool(flags & FLAG_AUTHOR_BOT),
+            reply_to_message_id=c["reply_to"][row] or None,
+            original_thread_id=c["thread_roots"][row] or None,
+        )
+
+    def __iter__(self):
+        for row in range(self.row_count):
+            yield self.row(row)
+
+    def get(self, message_id):
+        ids = self._columns["ids"]
+        id_order = self._columns["id_order"]
+        lo, hi = 0, self.row_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if ids[id_order[mid]] < message_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.row_count and ids[id_order[lo]] == message_id:
+            return self.row(id_order[lo])
+        return None
+
+    def time_range(self, start=None, end=None):
+        """Messages with start <= created_at < end, oldest first.
+
+        start and end are aware datetimes, None means unbounded.
+        """
+        timestamps = self._columns["timestamps"]
+        lo = 0 if start is None else bisect.bisect_left(timestamps, (start - EPOCH) // timedelta(microseconds=1))
+        hi = self.row_count if end is None else bisect.bisect_left(timestamps, (end - EPOCH) // timedelta(microseconds=1))
+        for row in range(lo, hi):
+            yield self.row(row)
+
+    def thread(self, root_id):
+        """All messages of the thread started by root_id, oldest first."""
+        roots = self._columns["thread_order_roots"]
+        rows = self._columns["thread_order_rows"]
+        lo = bisect.bisect_left(roots, root_id)
+        hi = bisect.bisect_right(roots, root_id)
+        for index in range(lo, hi):
+            yield self.row(rows[index])
@@ -0,0 +1,59 @@
+# Cold-start time until the private bot can generate its first founder reply.
+#   python benchmarks/bench_cold_start.py
+# "blocking" loads Teachability before the first reply, like the bot used to
+# at import; "background" starts the reply right away while WarmTeachability
+# loads the vector db in a thread. Needs ag2[teachable] installed; the reply
+# itself is a canned one, so no OpenAI key is used.
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from teachability_store import WarmTeachability
+
+
+def make_agent():
+    from autogen import ConversableAgent
+
+    agent = ConversableAgent(name="Founder_Actor_Agent", llm_config=False, human_input_mode="NEVER")
+    agent.register_reply([ConversableAgent, None], lambda *args, **kwargs: (True, "canned reply"), position=0)
+    return agent
+
+
+def first_reply(agent):
+    return agent.generate_reply(messages=[{"role": "user", "content": "hello"}])
+
+
+async def blocking(db_dir):
+    start = time.perf_counter()
+    agent = make_agent()
+    store = WarmTeachability(path_to_db_dir=db_dir)
+    await asyncio.to_thread(store._load, agent, threading.Lock())
+    first_reply(agent)
+    return time.perf_counter() - start, store.warm_seconds
+
+
+async def background(db_dir):
+    start = time.perf_counter()
+    agent = make_agent()
+    store = WarmTeachability(path_to_db_dir=db_dir)
+    warm_up = asyncio.create_task(store.warm_up(agent))
+    await asyncio.to_thread(first_reply, agent)
+    elapsed = time.perf_counter() - start
+    await warm_up
+    return elapsed, store.warm_seconds
+
+
+async def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, bench in (("blocking", blocking), ("background", background)):
+            first, warm = await bench(os.path.join(tmp, name))
+            print(f"{name:>10}: first reply after {first:6.2f}s, teachability warm after {warm:6.2f}s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,205 @@
+# End-to-end benchmark of on_message -> pipe -> listen_public_pipe_message ->
+# reply, without Discord or OpenAI: both bot modules are imported as they are,
+# their clients are swapped for fakes from fake_discord.py and their agents
+# talk to the stub LLM from stub_llm.py. The pipes are real FIFOs, or the
+# in-memory queues of main.py --single-process with --single-process.
+#   python benchmarks/bench_e2e.py [--messages N] [--rate R] [--channels C]
+#                                  [--llm-latency S] [--replay export.dcha]
+#                                  [--single-process]
+# --replay takes an export of history_download_main.py (.dcha archive or
+# json) instead of the synthetic stream. Needs the bots' dependencies (discord.py, ag2[openai]),
+# no tokens. Everything the bots write to ./tmp goes to a temporary directory.
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(BENCH_DIR, "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+from fake_discord import FakeClient, FakeGuild, FakeUser, synthetic_stream
+from stub_llm import StubLLM
+
+
+def percentile(samples, pct):
+    if not samples:
+        return float("nan")
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+def load_export(path):
+    if path.endswith(".dcha"):
+        from archive import ArchiveReader
+        with ArchiveReader(path) as reader:
+            return list(reader)
+    with open(path) as f:
+        return json.load(f)
+
+
+def recorded_stream(path, channels):
+    # channels of the export are mapped onto the fake channels round robin
+    records = sorted(load_export(path), key=lambda msg: int(msg["id"]))
+    channel_of = {}
+    index_of = {}
+    for i, msg in enumerate(records):
+        key = msg["guild_channel"]
+        if key not in channel_of:
+            channel_of[key] = channels[len(channel_of) % len(channels)]
+        index_of[int(msg["id"])] = i
+        reply_to = msg.get("reply_to_message_id")
+        yield channel_of[key], msg["author"], msg["content"], index_of.get(int(reply_to)) if reply_to else None
+
+
+def write_env_file(path, args, stub):
+    settings = {
+        "DISCORD_BOT_TOKEN": "benchmark",
+        "OPENAI_API_KEY": "sk-benchmark",
+        "OPENAI_BASE_URL": stub.base_url,
+        "DEBOUNCE_QUIET_SECONDS": args.quiet,
+        "DEBOUNCE_MAX_WAIT_SECONDS": args.quiet * 5,
+        "LLM_CACHE_BYPASS": "1",
+        "LLM_POOL_WORKERS": args.workers,
+        "LOG_LEVEL": "WARNING",
+    }
+    with open(path, "w") as f:
+        for key, value in settings.items():
+            f.write(f"{key}={value}\n")
+
+
+def import_bots(env_file, pipe_public_to_private, pipe_private_to_public):
+    # the bots read their env file and pipes from argv at import time
+    sys.argv = ["bench_e2e", env_file, pipe_public_to_private, pipe_private_to_public]
+    import bot_on_server
+    import bot_in_private
+    return bot_on_server, bot_in_private
+
+
+def is_idle(server, private):
+    return (
+        len(server.channel_debouncer) == 0
+        and all(writer.pending == 0 for writer in server.public_to_private_writers)
+        and not server.channel_debouncer._tasks
+        and not private.pipeline_tasks
+        and private.llm_pool.running + private.llm_pool.waiting == 0
+    )
+
+
+async def wait_until_idle(server, private, timeout):
+    deadline = time.monotonic() + timeout
+    quiet_polls = 0
+    while quiet_polls < 5:  # a frame may be in flight between the checks
+        if time.monotonic() > deadline:
+            return False
+        await asyncio.sleep(0.1)
+        quiet_polls = quiet_polls + 1 if is_idle(server, private) else 0
+    return True
+
+
+async def run(args):
+    replay = os.path.abspath(args.replay) if args.replay else None
+    workdir = tempfile.mkdtemp(prefix="bench_e2e_")
+    os.chdir(workdir)
+    stub = StubLLM(latency=args.llm_latency, jitter=args.llm_latency / 5).start()
+    env_file = os.path.join(workdir, ".env_bench")
+    write_env_file(env_file, args, stub)
+    pipes = [os.path.join(workdir, name) for name in ("public_to_private.pipe", "private_to_public.pipe")]
+    for pipe in pipes:
+        os.mkfifo(pipe)
+
+    if args.single_process:
+        import ipc
+        ipc.use_memory_transport()
+    server, private = import_bots(env_file, *pipes)
+    from logging_setup import correlation_id
+    from metrics import metrics
+    metrics.enabled = True
+
+    sent_at = {}  # message id -> time on_message was called
+    latencies = []
+
+    def record_reply(content):
+        # the correlation id is the id of the message that triggered the history
+        cid = correlation_id.get()
+        if cid is not None and int(cid) in sent_at:
+            latencies.append(time.perf_counter() - sent_at[int(cid)])
+
+    public_guild = FakeGuild("bench_public")
+    channels = [public_guild.add_channel(f"channel{i}") for i in range(args.channels)]
+    public_guild.add_channel("general")
+    private_guild = FakeGuild("bench_private")
+    private_guild.add_channel("general", send_latency=args.send_latency, on_send=record_reply)
+    server.client = FakeClient("bot_on_server", [public_guild])
+    private.client = FakeClient("bot_in_private", [private_guild])
+
+    # what the bots' main() does before serving; without the tiktoken
+    # encoding the packers fall back to estimated counts
+    await server.history_packer.warm_up()
+    await private.history_packer.warm_up()
+    await private.related_packer.warm_up()
+    for writer in server.public_to_private_writers:
+        writer.start()
+    private.private_to_public_writer.start()
+    listeners = [
+        asyncio.create_task(private.listen_public_pipe_message(private.client)),
+        asyncio.create_task(server.listen_private_pipe_message(server.client, pipes[1])),
+    ]
+
+    if replay:
+        stream = list(recorded_stream(replay, channels))[:args.messages]
+    else:
+        stream = list(synthetic_stream(channels, args.messages))
+    authors = {}
+    posted = []
+    interval = 1 / args.rate
+    start = time.perf_counter()
+    for i, (channel, author, content, reply_to) in enumerate(stream):
+        # pace against the schedule, not the previous send
+        delay = start + i * interval - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if author not in authors:
+            authors[author] = FakeUser(author)
+        message = channel.post(authors[author], content, reply_to=posted[reply_to].id if reply_to is not None else None)
+        posted.append(message)
+        sent_at[message.id] = time.perf_counter()
+        await server.on_message(message)
+    replayed = time.perf_counter() - start
+
+    drained = await wait_until_idle(server, private, args.timeout)
+    elapsed = time.perf_counter() - start
+    for task in listeners:
+        task.cancel()
+    stub.stop()
+
+    print(f"messages:        {len(stream)} in {replayed:.1f}s (target {args.rate}/s), drained after {elapsed:.1f}s{'' if drained else ' (TIMED OUT)'}")
+    print(f"throughput:      {len(stream) / elapsed:.1f} messages/s")
+    print(f"replies:         {len(latencies)}, llm calls: {stub.calls}")
+    print(f"e2e latency:     p50 {percentile(latencies, 50):.3f}s, p99 {percentile(latencies, 99):.3f}s")
+    print(f"peak rss:        {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB")
+    print(metrics.summary())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=20, help="messages per second")
+    parser.add_argument("--channels", type=int, default=4)
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds per stub completion")
+    parser.add_argument("--send-latency", type=float, default=0.05, help="seconds per channel.send")
+    parser.add_argument("--quiet", type=float, default=0.5, help="debounce quiet period")
+    parser.add_argument("--workers", type=int, default=4, help="llm pool workers")
+    parser.add_argument("--timeout", type=float, default=300, help="max seconds to wait for the replies")
+    parser.add_argument("--replay", help="export of history_download_main.py (.dcha or .json)")
+    parser.add_argument("--single-process", action="store_true", help="in-memory transport instead of the FIFOs")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# Round-trip benchmark of the bot-to-bot pipe.
+#   python benchmarks/bench_ipc.py [messages]
+# "legacy" reopens the FIFO and pickles once per message, like the bots used to,
+# "framed" uses the long-lived PipeReader/PipeWriter from ipc.py.
+import asyncio
+import os
+import pickle
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from data_definition import MessageHistory, MessageRecord
+from ipc import PipeReader, PipeWriter
+
+
+def sample_history(size=5):
+    msg_list = []
+    for i in range(size):
+        msg_list.append(MessageRecord(
+            1000 + i, f"user{i % 3}", "some message content " * 4, "2025-01-01 00:00:00+00:00",
+            1, 2, "guild_general", original_thread_id=1000 + i,
+        ))
+    return MessageHistory(msg_list)
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+async def legacy_round_trips(ping, pong, count, message):
+    def write(pipe_name, obj):
+        with open(pipe_name, "wb") as pipe:
+            pickle.dump(obj, pipe)
+
+    def read(pipe_name):
+        with open(pipe_name, "rb") as pipe:
+            return pickle.load(pipe)
+
+    async def echo():
+        for _ in range(count):
+            obj = await asyncio.to_thread(read, ping)
+            await asyncio.to_thread(write, pong, obj)
+
+    echo_task = asyncio.create_task(echo())
+    samples = []
+    for _ in range(count):
+        start = time.perf_counter()
+        await asyncio.to_thread(write, ping, message)
+        await asyncio.to_thread(read, pong)
+        samples.append(time.perf_counter() - start)
+    await echo_task
+    return samples
+
+
+async def framed_round_trips(ping, pong, count, message):
+    ping_reader = await PipeReader(ping).open()
+    pong_reader = await PipeReader(pong).open()
+    ping_writer = PipeWriter(ping).start()
+    pong_writer = PipeWriter(pong).start()
+
+    async def echo():
+        for _ in range(count):
+            await pong_writer.send(await ping_reader.recv())
+
+    echo_task = asyncio.create_task(echo())
+    samples = []
+    for _ in range(count):
+        start = time.perf_counter()
+        await ping_writer.send(message)
+        await pong_reader.recv()
+        samples.append(time.perf_counter() - start)
+    await echo_task
+    for writer in (ping_writer, pong_writer):
+        await writer.close()
+    for reader in (ping_reader, pong_reader):
+        reader.close()
+    return samples
+
+
+async def main(count):
+    message = sample_history()
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, bench in (("legacy", legacy_round_trips), ("framed", framed_round_trips)):
+            ping = os.path.join(tmp, f"{name}_ping.pipe")
+            pong = os.path.join(tmp, f"{name}_pong.pipe")
+            os.mkfifo(ping)
+            os.mkfifo(pong)
+            start = time.perf_counter()
+            samples = await bench(ping, pong, count, message)
+            elapsed = time.perf_counter() - start
+            print(f"{name}: {count / elapsed:8.0f} round trips/s, "
+                  f"p50 {percentile(samples, 50) * 1e6:7.0f} us, p99 {percentile(samples, 99) * 1e6:7.0f} us")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000))
@@ -0,0 +1,76 @@
+# Memory of a channel history held as per-message dicts (msg_list + msg_dict,
+# as download_channel_history used to build it) versus MessageRecord.
+#   python benchmarks/bench_message_memory.py
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from data_definition import MessageHistory, MessageRecord
+
+GUILD_ID = 1097941234567890123
+CHANNEL_ID = 1097941234567890456
+
+
+def message_fields(i):
+    message_id = 1200000000000000000 + i
+    author = f"user{i % 200}"
+    # strings built per message, like str(message.author) returns a new object each time
+    return message_id, "".join([author]), f"message number {i} with some typical chat content", f"2025-01-01 00:00:{i % 60:02d}.{i % 1000:06d}+00:00"
+
+
+def build_dicts(count):
+    msg_list = []
+    msg_dict = {}
+    for i in range(count):
+        message_id, author, content, timestamp = message_fields(i)
+        message_data = {
+            "id": str(message_id),
+            "author": author,
+            "content": content,
+            "timestamp": timestamp,
+            "link": f"https://discord.com/channels/{GUILD_ID}/{CHANNEL_ID}/{message_id}",
+            "is_thread": True,
+            "is_reply": False,
+            "author_is_bot": False,
+            "guild_channel": f"{'guild'}_{'general'}",
+            "original_thread_id": message_id,
+        }
+        msg_list.append(message_data)
+        msg_dict[message_id] = message_data
+    return msg_list, msg_dict
+
+
+def build_records(count):
+    msg_list = []
+    for i in range(count):
+        message_id, author, content, timestamp = message_fields(i)
+        msg_list.append(MessageRecord(
+            message_id, author, content, timestamp, GUILD_ID, CHANNEL_ID, f"{'guild'}_{'general'}",
+            original_thread_id=message_id,
+        ))
+    return MessageHistory(msg_list)
+
+
+def measure(build, count):
+    tracemalloc.start()
+    result = build(count)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size, result
+
+
+def main():
+    for count in (10_000, 100_000):
+        dict_size, (msg_list, msg_dict) = measure(build_dicts, count)
+        record_size, history = measure(build_records, count)
+        dict_payload = len(json.dumps(msg_list))
+        record_payload = len(json.dumps(history.to_dict()))
+        print(f"{count:>7} messages: dicts {dict_size / 2**20:7.1f} MiB, records {record_size / 2**20:7.1f} MiB "
+              f"({record_size / dict_size:.0%}); pipe payload {dict_payload / 2**20:6.1f} MiB -> {record_payload / 2**20:6.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# Time from process start until a bot is ready to call client.start().
+#   python benchmarks/bench_startup.py [runs]
+# "eager" imports what the bots used to import at module level and builds
+# all their agents; "lazy" imports what they import now, agents are built by
+# the AgentRegistry on first use. Each case runs in a fresh interpreter.
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+EAGER = """
+import discord, aiohttp, dotenv
+import autogen
+from autogen import AssistantAgent, ConversableAgent
+from autogen.agentchat.contrib.swarm_agent import SwarmResult, initiate_swarm_chat
+from autogen.agentchat.contrib.capabilities.teachability import Teachability
+from pydantic import BaseModel
+config = {"config_list": [{"model": "gpt-4", "api_key": "sk-benchmark"}]}
+AssistantAgent(name="assistant", llm_config=config)
+for name in ("UserProxyAgent", "Founder_Actor_Agent", "conversation_split", "topic_group", "business_theme_agent"):
+    ConversableAgent(name=name, system_message="benchmark", llm_config=config)
+"""
+
+LAZY = """
+import discord, aiohttp, dotenv
+from agent_registry import AgentRegistry
+from teachability_store import teachability_from_env
+import data_definition, ipc, llm_pool, llm_cache, rolling_summary, prompt_packing
+AgentRegistry({}, "sk-benchmark")
+teachability_from_env()
+"""
+
+
+def run(code):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        return None, result.stderr.strip().splitlines()[-1]
+    return time.perf_counter() - start, None
+
+
+def main(runs):
+    for name, code in (("eager", EAGER), ("lazy", LAZY)):
+        samples = []
+        for _ in range(runs):
+            elapsed, error = run(code)
+            if error:
+                print(f"{name:>5}: skipped, {error}")
+                break
+            samples.append(elapsed)
+        if samples:
+            print(f"{name:>5}: median {statistics.median(samples) * 1000:7.0f} ms over {runs} runs")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
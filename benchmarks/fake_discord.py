@@ -0,0 +1,130 @@
+# Stand-ins for the discord.py objects the bots touch: enough of Client,
+# Guild, TextChannel, Message and channel.history() to drive on_message and
+# the pipe listeners without a gateway connection.
+import asyncio
+import itertools
+import random
+import time
+from datetime import datetime, timezone
+
+_snowflakes = itertools.count(1_300_000_000_000_000_000)
+
+
+def next_id():
+    return next(_snowflakes)
+
+
+class FakeUser:
+    def __init__(self, name, bot=False):
+        self.id = next_id()
+        self.name = name
+        self.bot = bot
+
+    def __str__(self):
+        return self.name
+
+
+class FakeReference:
+    def __init__(self, message_id):
+        self.message_id = message_id
+
+
+class FakeMessage:
+    def __init__(self, channel, author, content, reply_to=None, created_at=None):
+        self.id = next_id()
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.reference = FakeReference(reply_to) if reply_to else None
+        self.mentions = []
+        self.created_at = created_at or datetime.now(timezone.utc)
+
+
+class FakeChannel:
+    """A text channel that keeps its messages in memory.
+
+    send() records (time, content) in sent, and optionally calls on_send with
+    the content, which is where the benchmark takes its timestamps.
+    """
+
+    def __init__(self, guild, name, send_latency=0.0, on_send=None):
+        self.id = next_id()
+        self.guild = guild
+        self.name = name
+        self.messages = []  # oldest first
+        self.sent = []
+        self.send_latency = send_latency
+        self.on_send = on_send
+
+    def post(self, author, content, reply_to=None, created_at=None):
+        message = FakeMessage(self, author, content, reply_to, created_at)
+        self.messages.append(message)
+        return message
+
+    async def history(self, limit=100, after=None, oldest_first=None):
+        messages = self.messages
+        if after is not None:
+            messages = [message for message in messages if message.id > after.id]
+        if oldest_first is None:
+            oldest_first = after is not None  # discord.py's default
+        if oldest_first:
+            selected = messages[:limit]
+        else:
+            selected = messages[::-1][:limit]
+        for message in selected:
+            await asyncio.sleep(0)
+            yield message
+
+    async def send(self, content):
+        if self.send_latency:
+            await asyncio.sleep(self.send_latency)
+        self.sent.append((time.perf_counter(), content))
+        if self.on_send is not None:
+            self.on_send(content)
+        return self.post(FakeUser("bot", bot=True), content)
+
+
+class FakeGuild:
+    def __init__(self, name):
+        self.id = next_id()
+        self.name = name
+        self.text_channels = []
+
+    def add_channel(self, name, **kwargs):
+        channel = FakeChannel(self, name, **kwargs)
+        self.text_channels.append(channel)
+        return channel
+
+
+class FakeClient:
+    def __init__(self, name, guilds):
+        self.user = FakeUser(name, bot=True)
+        self.guilds = guilds
+
+    async def wait_until_ready(self):
+        return
+
+    def get_channel(self, channel_id):
+        for guild in self.guilds:
+            for channel in guild.text_channels:
+                if channel.id == channel_id:
+                    return channel
+        return None
+
+
+def synthetic_stream(channels, count, authors=8, reply_ratio=0.3, seed=1):
+    """(channel, author name, content, reply_to) tuples, reply_to is the index
+    of an earlier message of the stream or None."""
+    rng = random.Random(seed)
+    users = [f"user{i}" for i in range(authors)]
+    words = ("feature", "bug", "pricing", "export", "login", "slow", "api", "docs", "release", "thanks")
+    posted = {channel: [] for channel in channels}
+    for i in range(count):
+        channel = rng.choice(channels)
+        reply_to = None
+        if posted[channel] and rng.random() < reply_ratio:
+            reply_to = rng.choice(posted[channel][-20:])
+        content = " ".join(rng.choice(words) for _ in range(rng.randint(5, 40)))
+        posted[channel].append(i)
+        yield channel, rng.choice(users), content, reply_to
@@ -0,0 +1,92 @@
+# A local stand-in for the OpenAI chat completions API.
+#   python benchmarks/stub_llm.py [port] [latency_seconds]
+# Point the bots at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1.
+# Every completion waits `latency` seconds (plus up to `jitter`) and answers
+# with a ReplyFormat json, which is also a fine plain-text answer for the
+# summary agents.
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubLLM:
+    def __init__(self, port=0, latency=0.5, jitter=0.1, need_human_reply_score=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.need_human_reply_score = need_human_reply_score
+        self.calls = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+    def completion(self, request):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency + random.uniform(0, self.jitter))
+        content = json.dumps({
+            "need_human_reply_score": self.need_human_reply_score,
+            "reason": "stub",
+            "response": "stub reply",
+        })
+        prompt_tokens = sum(len(str(m.get("content") or "")) for m in request.get("messages", [])) // 4
+        return {
+            "id": f"chatcmpl-stub-{self.calls}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 20, "total_tokens": prompt_tokens + 20},
+        }
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if not self.path.endswith("/chat/completions"):
+                    self.send_error(404)
+                    return
+                payload = json.dumps(stub.completion(json.loads(body))).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+if __name__ == "__main__":
+    stub = StubLLM(
+        port=int(sys.argv[1]) if len(sys.argv) > 1 else 8901,
+        latency=float(sys.argv[2]) if len(sys.argv) > 2 else 0.5,
+    )
+    print(f"stub LLM on {stub.base_url}")
+    stub.start()._thread.join()
@@ -1,26 +1,34 @@
 import asyncio
+import contextlib
+import logging
 import os
-import pickle
 import sys
-from typing import Annotated
+import threading
 import aiohttp
 from dotenv import load_dotenv
 import discord
 from discord.ext import commands
 from discord import app_commands
-import autogen
-import os
-from autogen import AssistantAgent, ConversableAgent
-# AFTER_WORK, ON_CONDITION, AfterWorkOption
-from autogen.agentchat.contrib.swarm_agent import SwarmResult, initiate_swarm_chat
+# autogen, pydantic and the teachability db are heavy to import, they are
+# loaded by the agent registry when a pipeline first needs an agent
 
-from autogen.agentchat.contrib.capabilities.teachability import Teachability
-from pydantic import BaseModel
+from agent_registry import AgentRegistry
+from teachability_store import teachability_from_env
 
-# used implicitly by pipe.load_pickle
 import data_definition
 from data_definition import MessageHistory
-from utils import async_pickle_load # type: ignore
+from ipc import open_reader, writer_from_env
+import heartbeat
+from metrics import count_llm_calls, metrics, start_from_env as start_metrics_from_env
+from llm_pool import LLMJobTimeout, pool_from_env
+from llm_cache import cache_from_env
+from rolling_summary import RollingSummaryStore
+from prompt_packing import HistoryPacker, packer_from_env
+from send_scheduler import scheduler_from_env
+from routing import PIPELINE_FOUNDER_REPLY, routing_from_env
+from retrieval import retriever_from_env
+from dag import DagExecutor
+from logging_setup import setup_logging
 import json
 
 #   source ./venv/bin/activate
@@ -38,15 +46,31 @@ class DataProcesser:
 # rudy server token
 
 env_file = sys.argv[1]
-print(f"env_file from bot_in_private: {env_file}")
 load_dotenv(dotenv_path=env_file, override=True)
 open_ai_key = os.environ["OPENAI_API_KEY"]
-config_list = [{"model": "gpt-4o-mini", "api_key": open_ai_key}]
 
-# create an AssistantAgent instance named "assistant" with the LLM configuration.
-assistant = AssistantAgent(name="assistant", llm_config={"config_list": config_list})
+setup_logging("bot_in_private")
+logger = logging.getLogger("bot_in_private")
+logger.info("env loaded", extra={"env_file": env_file})
+
+# index of this process among the PRIVATE_WORKERS of main.py. All workers log
+# in with the same token: only worker 0 handles the gateway-only events
+# (on_message, command sync), and every worker keeps its data in its own
+# directories, the chroma and summary files are not safe to share.
+private_worker = int(os.getenv("PRIVATE_WORKER", "0"))
+
+
+def worker_path(path):
+    # worker 0 keeps the original paths, like its pipes
+    return path if private_worker == 0 else f"{path}.{private_worker}"
+
 
-def founder_mentioned(context_variables: dict) -> SwarmResult:
+for key, default in (("TEACHABILITY_DB_DIR", "./tmp/notebook/teachability_db"), ("RETRIEVAL_DB_DIR", "./tmp/retrieval_db")):
+    os.environ[key] = worker_path(os.getenv(key, default))
+
+
+def founder_mentioned(context_variables: dict):
+    from autogen.agentchat.contrib.swarm_agent import SwarmResult
     # Returning the updated context so the shared context can be updated
     # how to access the message passed to the agent.
     # then decide to update context variables or not.
@@ -54,99 +78,104 @@ def founder_mentioned(context_variables: dict) -> SwarmResult:
     return SwarmResult(context_variables=context_variables)
 
 
-def history_split(context_variables: dict) -> SwarmResult:
+def history_split(context_variables: dict):
+    from autogen.agentchat.contrib.swarm_agent import SwarmResult
     # Returning the updated context so the shared context can be updated
     # how to access the message passed to the agent.
     # then decide to update context variables or not.
     return SwarmResult(context_variables=context_variables)
 
-teachability = Teachability(
-    verbosity=0,  # 0 for basic info, 1 to add memory operations, 2 for analyzer messages, 3 for memo lists.
-    reset_db=True,
-    path_to_db_dir="./tmp/notebook/teachability_db",
-    recall_threshold=1.5,  # Higher numbers allow more (but less relevant) memos to be recalled.
-)
+# the memo db is kept across restarts and loaded in the background once the
+# gateway is connected, see on_ready
+teachability = teachability_from_env()
+# TEACHABILITY_WAIT=1 queues replies until the memos can be recalled, otherwise
+# replies before that are generated without recall
+wait_for_teachability = os.getenv("TEACHABILITY_WAIT", "0") == "1"
+# "structured": one founder call, its ReplyFormat json validated by pydantic.
+# "reflection": the founder chat plus a reflection_with_llm summary call.
+reply_mode = os.getenv("REPLY_MODE", "structured")
+reply_max_retries = int(os.getenv("REPLY_MAX_RETRIES", "2"))
 
 
-founder_list = []
+class InvalidReply(Exception):
+    pass
+
 
-llm_config = {"config_list": [{"model": "gpt-4", "api_key": os.environ["OPENAI_API_KEY"]}]}
+class Superseded(Exception):
+    pass
+
+
+founder_list = []
 
 context_variables = {
     "founder_mentioned": False,
     "business_theme": False,
 }
 
-user_proxy_agent = ConversableAgent(
-    name="UserProxyAgent",
-    system_message="You are a user who want to analyze the business themes from the chat history.",
-    llm_config={"config_list": [{"model": "gpt-4", "api_key": open_ai_key}]},
-)
-
-
-
-class ReplyFormat(BaseModel):
-    need_human_reply_score: Annotated[int, "Must be between 1 and 10"]
-    reason: str
-    response: str
-
-founder_actor_agent = ConversableAgent(
-    name="Founder_Actor_Agent",
-    system_message="""You are a founder actor of the company.
+AGENT_SPECS = {
+    "UserProxyAgent": {
+        "system_message": "You are a user who want to analyze the business themes from the chat history.",
+        "model": "gpt-4",
+    },
+    "Founder_Actor_Agent": {
+        "system_message": """You are a founder actor of the company.
     """,
-    llm_config={"config_list": [{
         "model": "gpt-4o-mini",
-        "api_key": os.environ["OPENAI_API_KEY"],
-        "response_format": ReplyFormat,
-        }]},
-    #summary_method="reflection_with_llm",
-    #functions=[founder_mentioned]
-)
-
-# first time chat takes 10s of seconds  to load the vector database
-teachability.add_to_agent(founder_actor_agent)
-
-conversation_split = ConversableAgent(
-    name="conversation_split",
-    system_message="You are a expert who can split the conversation history from several part. each part is a whole conversation of a topic.",
-    llm_config={"config_list": [{"model": "gpt-4o-mini", "api_key": open_ai_key}]},
-    #functions=[history_split]
-)
-
-topic_group = ConversableAgent(
-    name="topic_group",
-    system_message="you are a expert who can summarize the conversation topic and aggregate the same topic",
-    llm_config={"config_list": [{"model": "gpt-4", "api_key": open_ai_key}]},
-)
-
-business_theme_agent = ConversableAgent(
-    name="business_theme_agent",
-    system_message="You are a business analyst who excels at discovering business themes in conversation transcripts.",
-    llm_config={"config_list": [{"model": "gpt-4", "api_key": open_ai_key}]},
-)
-
-nested_chats = [
-    {
-        "recipient": conversation_split,
-        "summary_method": "reflection_with_llm",
-        "summary_prompt": "Please split the conversation history into several parts, each part is a whole conversation of a topic.",
+        "response_format": "reply_format:ReplyFormat",
+        #"functions": [founder_mentioned],
     },
-    {
-        "recipient": topic_group,
-        "message": "Please organize the conversation history into topics.",
-        "summary_method": "reflection_with_llm",
+    "conversation_split": {
+        "system_message": "You are a expert who can split the conversation history from several part. each part is a whole conversation of a topic.",
+        "model": "gpt-4o-mini",
+        #"functions": [history_split],
+    },
+    "topic_split": {
+        "system_message": "You are a expert who can split the conversation history from several part. each part is a whole conversation of a topic.",
+        "model": "gpt-4o-mini",
+        "response_format": "reply_format:TopicSplit",
     },
-    {
-        "recipient": business_theme_agent,
-        "message": "Please find the business theme from the conversation history or the last message.",
-        "max_turns": 1,
-        "summary_method": "last_msg",
+    "topic_group": {
+        "system_message": "you are a expert who can summarize the conversation topic and aggregate the same topic",
+        "model": "gpt-4",
     },
-]
+    "business_theme_agent": {
+        "system_message": "You are a business analyst who excels at discovering business themes in conversation transcripts.",
+        "model": "gpt-4",
+    },
+}
 
-#founder_actor_agent.register_nested_chats(
-#    nested_chats,
-#    trigger=lambda sender: sender not in [conversation_split, topic_group, business_theme_agent],
+agents = AgentRegistry(AGENT_SPECS, open_ai_key, base_url=os.getenv("OPENAI_BASE_URL"))
+
+
+def make_swarm_agents():
+    # swarm chats keep state on the agents, so every pipeline job gets its own set
+    return agents.build("conversation_split"), agents.build("topic_group"), agents.build("business_theme_agent")
+
+
+def make_nested_chats(conversation_split, topic_group, business_theme_agent):
+    return [
+        {
+            "recipient": conversation_split,
+            "summary_method": "reflection_with_llm",
+            "summary_prompt": "Please split the conversation history into several parts, each part is a whole conversation of a topic.",
+        },
+        {
+            "recipient": topic_group,
+            "message": "Please organize the conversation history into topics.",
+            "summary_method": "reflection_with_llm",
+        },
+        {
+            "recipient": business_theme_agent,
+            "message": "Please find the business theme from the conversation history or the last message.",
+            "max_turns": 1,
+            "summary_method": "last_msg",
+        },
+    ]
+
+#swarm_agents = make_swarm_agents()
+#agents.get("Founder_Actor_Agent").register_nested_chats(
+#    make_nested_chats(*swarm_agents),
+#    trigger=lambda sender: sender not in swarm_agents,
 #)
 
 
@@ -164,6 +193,34 @@ intents.message_content = True
 client = discord.Client(intents=intents)
 tree = app_commands.CommandTree(client)
 
+# one long-lived framed stream back to the server bot
+private_to_public_writer = writer_from_env(sys.argv[3])
+
+# agent pipelines run here, off the event loop
+llm_pool = pool_from_env()
+founder_lock = threading.Lock()
+teachability_task = None
+# repeated histories and re-deliveries reuse the stage results
+llm_cache = cache_from_env()
+pipeline_tasks = set()
+# channel id -> the newest history received, while its pipeline runs
+latest_history_by_channel = {}
+summary_store = RollingSummaryStore(worker_path("./tmp/rolling_summaries"),
+                                    compact_every=int(os.getenv("SUMMARY_COMPACT_EVERY", "10")))
+channel_summary_locks = {}
+history_packer = packer_from_env()
+# replies to Discord go through per-channel paced queues
+send_scheduler = scheduler_from_env()
+# where the history of each source channel is posted, and with which pipeline
+routing = routing_from_env()
+# earlier messages related to the trigger, None when RETRIEVAL_ENABLED is off
+retriever = retriever_from_env()
+retrieval_top_k = int(os.getenv("RETRIEVAL_TOP_K", "5"))
+related_packer = HistoryPacker(token_budget=int(os.getenv("RETRIEVAL_TOKEN_BUDGET", "800")))
+# "swarm": one swarm chat. "dag": split into topics, analyze them concurrently, merge.
+summary_pipeline = os.getenv("SUMMARY_PIPELINE", "swarm")
+dag_max_concurrency = int(os.getenv("DAG_MAX_CONCURRENCY", "4"))
+
 
 #class Message:
 #    def __init__(self, msg_list: list, msg_dict: dict):
@@ -175,123 +232,442 @@ tree = app_commands.CommandTree(client)
 async def on_message(message):
     if message.author == client.user:  # ignore the message from the bot itself
         return
-    print(f"Message received in private: {message.content}, author: {message.author}, user: {client.user}")
+    if private_worker != 0:  # every worker gets the event, one answers
+        return
+    logger.debug("message received", extra={"author": str(message.author), "channel": message.channel.name})
     channel = message.channel
-    pipe_name_private_to_public = sys.argv[3]
-    print(f"pipe_name from bot_in_private: {pipe_name_private_to_public}")
 
     # teach the message to the founder_actor_agent
 
-    if not os.path.exists(pipe_name_private_to_public):
-        os.mkfifo(pipe_name_private_to_public)
     try:
-        with open(pipe_name_private_to_public, "wb") as pipe:
-            print(f"pipe_name opened: {pipe_name_private_to_public}")
-            pickle.dump(message.content,pipe)
-        print(f"Message sent to pipe: {message.content}")
-    except Exception as e:
-        print(f"Error sending message to pipe in private: {e}")
+        await private_to_public_writer.send(message.content)
+        logger.debug("message sent to pipe")
+    except Exception:
+        logger.exception("error sending message to pipe")
 
     await channel.send('Echo from private:' + message.content)
 
 
+@client.event
+async def on_ready():
+    logger.info("logged in", extra={"user": str(client.user)})
+    routing.refresh(client)
+    if teachability_task is None:
+        start_teachability_warm_up()
+
+
+# destinations are resolved by id once, and again whenever channels change
+@client.event
+async def on_guild_channel_create(channel):
+    routing.refresh(client)
+
+
+@client.event
+async def on_guild_channel_delete(channel):
+    routing.refresh(client)
+
+
+@client.event
+async def on_guild_channel_update(before, after):
+    routing.refresh(client)
+
+
+@client.event
+async def on_guild_join(guild):
+    routing.refresh(client)
+
+
+@client.event
+async def on_guild_remove(guild):
+    routing.refresh(client)
+
+
+def start_teachability_warm_up():
+    global teachability_task
+    teachability_task = asyncio.create_task(warm_up_founder_agent())
+
+
+async def warm_up_founder_agent():
+    # first time chat takes 10s of seconds to load the vector database,
+    # building the agent imports autogen, keep both off the event loop
+    try:
+        founder_actor_agent = await asyncio.to_thread(agents.get, "Founder_Actor_Agent")
+    except Exception:
+        logger.exception("founder agent could not be built, replying without memo recall")
+        teachability.ready.set()
+        return
+    await teachability.warm_up(founder_actor_agent, founder_lock)
+
+
 @client.event
 async def setup_hook():
-  await tree.sync()
+  if private_worker == 0:
+    await tree.sync()
+
+
+
 
-print(f"TOKEN in bot_in_private: {TOKEN}")
 
 
+def run_swarm_summary(message):
+    # blocking, runs on the llm pool
+    from autogen.agentchat.contrib.swarm_agent import initiate_swarm_chat
 
+    conversation_split, topic_group, business_theme_agent = make_swarm_agents()
+
+    def swarm_chat():
+        chat_result, context_variables, last_agent = initiate_swarm_chat(
+            initial_agent=conversation_split,
+            agents=[conversation_split, topic_group, business_theme_agent],
+            messages=message,
+            #context_variables=shared_context,
+        )
+        return chat_result.summary
+
+    key = llm_cache.make_key("swarm_summary", [conversation_split, topic_group, business_theme_agent], message)
+    return llm_cache.get_or_compute(key, swarm_chat)
+
+
+def ask_agent(name, content):
+    # blocking, runs on the llm pool. A fresh agent, so concurrent jobs never share one.
+    reply = agents.build(name).generate_reply(messages=[{"role": "user", "content": content}])
+    return reply.get("content") if isinstance(reply, dict) else reply
+
+
+def run_summary_compaction(summary):
+    return ask_agent("topic_group", f"Please condense this running summary of a chat, merge the same topics: {summary}")
+
+
+def json_object(text):
+    # models wrap json in code fences or prose now and then, keep the object
+    start, end = text.find("{"), text.rfind("}")
+    return text[start:end + 1] if start != -1 and end > start else text
+
+
+def split_topics(prompt):
+    from pydantic import ValidationError
+    from reply_format import TopicSplit
+
+    reply = ask_agent("topic_split", (
+        "Split the chat history below into its topics, each with the lines of the history about it.\n" + prompt
+    ))
+    try:
+        split = TopicSplit.model_validate_json(json_object(reply or ""))
+    except ValidationError as e:
+        logger.warning("topic split is not valid, analyzing one topic", extra={"error": str(e)})
+        metrics.count("topic_split_fallbacks")
+        return [prompt]
+    return [f"{topic.topic}:\n" + "\n".join(topic.messages) for topic in split.topics] or [prompt]
+
+
+def analyze_topic(topic):
+    return ask_agent("topic_group", f"Please summarize this conversation topic: {topic}")
+
+
+def merge_topics(*topic_summaries):
+    return ask_agent("business_theme_agent", (
+        "Merge these topic summaries of a chat into one summary, with the business themes:\n\n"
+        # an agent may answer with no content
+        + "\n\n".join(summary for summary in topic_summaries if summary)
+    ))
+
+
+async def run_topic_dag(prompt):
+    # split -> one analysis per topic, concurrently -> merge. Wall clock is the
+    # split, the slowest topic and the merge instead of the sum of all calls.
+    def cache_key():
+        # building the agents for their fingerprint may import autogen, off the loop
+        dag_agents = [agents.get(name) for name in ("topic_split", "topic_group", "business_theme_agent")]
+        return llm_cache.make_key("topic_dag", dag_agents, prompt)
+
+    key = await asyncio.to_thread(cache_key)
+    if not llm_cache.bypass:
+        summary = await asyncio.to_thread(llm_cache.get, key)
+        if summary is not None:
+            return summary
+
+    async def fan_out(dag, topics):
+        names = [f"analyze:{i}" for i in range(len(topics))]
+        for name, topic in zip(names, topics):
+            dag.add(name, lambda topic=topic: analyze_topic(topic))
+        dag.add("merge", merge_topics, deps=names)
+
+    dag = DagExecutor(llm_pool.run, max_concurrency=dag_max_concurrency)
+    dag.add("split", lambda: split_topics(prompt))
+    dag.add("fan_out", fan_out, deps=["split"])
+    results = await dag.wait()
+    logger.debug("topic dag done", extra={"timings": dag.timings})
+    if not llm_cache.bypass and results["merge"] is not None:
+        await asyncio.to_thread(llm_cache.set, key, results["merge"])
+    return results["merge"]
+
+
+def run_founder_reply(summary):
+    # blocking, runs on the llm pool. The founder agent and its teachability
+    # db are shared, so only one reply is generated at a time.
+    message = f"Please try to reply to the message based on the chat history summary.  {summary}. "
+    user_proxy_agent = agents.get("UserProxyAgent")
+    founder_actor_agent = agents.get("Founder_Actor_Agent")
+
+    def founder_chat():
+        with founder_lock:
+            reply_result = user_proxy_agent.initiate_chat(
+                founder_actor_agent,
+                message=message,
+                summary_method="reflection_with_llm",
+                max_turns=1,
+            )
+        return reply_result.summary
+
+    key = llm_cache.make_key("founder_reply", [user_proxy_agent, founder_actor_agent], message)
+    return llm_cache.get_or_compute(key, founder_chat)
+
+
+def run_structured_founder_reply(summary):
+    # blocking, runs on the llm pool. One founder call, the ReplyFormat json of
+    # its last message is the result. Only this call is retried when the json
+    # does not validate, at most reply_max_retries times.
+    from pydantic import ValidationError
+    from reply_format import ReplyFormat
+
+    message = f"Please try to reply to the message based on the chat history summary.  {summary}. "
+    founder_actor_agent = agents.get("Founder_Actor_Agent")
+
+    def founder_reply():
+        messages = [{"role": "user", "content": message}]
+        for attempt in range(reply_max_retries + 1):
+            # a retry turn is about the format, teachability must not recall
+            # for it or store memos from it
+            with founder_lock, teachability.suspended(founder_actor_agent) if attempt else contextlib.nullcontext():
+                reply = founder_actor_agent.generate_reply(messages=messages)
+            content = (reply.get("content") if isinstance(reply, dict) else reply) or ""
+            try:
+                return ReplyFormat.model_validate_json(content).model_dump_json()
+            except ValidationError as e:
+                metrics.count("reply_validation_retries")
+                messages = messages + [
+                    {"role": "assistant", "content": content},
+                    {"role": "user", "content": f"That reply is not valid: {e}. Answer again with only the JSON object."},
+                ]
+        raise InvalidReply(f"no valid reply after {reply_max_retries + 1} attempts")
+
+    key = llm_cache.make_key("founder_reply_structured", [founder_actor_agent], message)
+    return llm_cache.get_or_compute(key, founder_reply)
+
+
+def run_history_analysis(history):
+    # blocking, runs on the llm pool. One business theme analysis of the packed
+    # history, no rolling summary and no founder reply.
+    message = f"Please analyze this chat history, its topics and business themes:\n{history}"
+    key = llm_cache.make_key("history_analysis", [agents.get("business_theme_agent")], message)
+    return llm_cache.get_or_compute(key, lambda: ask_agent("business_theme_agent", message))
+
+
+def is_superseded(message_data):
+    # a newer history of the same channel arrived while this one was waiting
+    return latest_history_by_channel.get(message_data.msg_list[0].channel_id) is not message_data
+
+
+def check_superseded(message_data):
+    if is_superseded(message_data):
+        raise Superseded()
+
+
+def unless_superseded(message_data, fn):
+    # checked again once the job got its pool slot, which can take a while
+    def job(*args):
+        check_superseded(message_data)
+        return fn(*args)
+    job.__name__ = fn.__name__
+    return job
+
+
+async def related_context(message_data):
+    # the earlier discussion of the trigger's topic, in its own token budget
+    if retriever is None:
+        return ""
+    trigger = max(message_data.msg_list, key=lambda msg: msg.id)
+    related = await retriever.related(trigger, k=retrieval_top_k, exclude_ids=list(message_data.msg_dict))
+    if not related:
+        return ""
+    return "Related earlier messages of this channel:\n" + related_packer.pack(related).text + "\n\n"
+
+
+def pack_oldest(delta):
+    # the longest oldest-first run of delta that fits the budget, and its text.
+    # The watermark can only move past a run, the packer keeps the newest first.
+    packed = history_packer.pack(delta)
+    if packed.messages_dropped == 0:
+        return delta, packed
+    fits, too_long = 1, len(delta)
+    while too_long - fits > 1:
+        middle = (fits + too_long) // 2
+        if history_packer.pack(delta[:middle]).messages_dropped == 0:
+            fits = middle
+        else:
+            too_long = middle
+    return delta[:fits], history_packer.pack(delta[:fits])
+
+
+async def update_channel_summary(message_data):
+    # feeds the swarm only the messages after the channel's watermark plus the
+    # running summary, returns the new summary and the new messages. Keyed by
+    # channel id, a renamed channel keeps its summary.
+    channel_key = message_data.msg_list[0].channel_id
+    if channel_key not in channel_summary_locks:
+        channel_summary_locks[channel_key] = asyncio.Lock()
+    async with channel_summary_locks[channel_key]:
+        check_superseded(message_data)
+        state = summary_store.load(channel_key)
+        delta = state.delta(message_data.msg_list)
+        if not delta:
+            return None, ''
+        histories = []
+        related = await related_context(message_data)
+        # more than the token budget is summarized in several passes, oldest
+        # first, the watermark only moves past messages that were in a prompt
+        while delta:
+            chunk, packed = pack_oldest(delta)
+            delta = delta[len(chunk):]
+            logger.debug("packed history", extra={"channel_id": channel_key, "tokens_used": packed.tokens_used,
+                                                  "messages_used": packed.messages_used, "messages_left": len(delta)})
+            if not packed.ids:
+                logger.warning("message over the token budget skipped", extra={"message_id": chunk[0].id})
+                state.watermark_id = max(state.watermark_id, chunk[-1].id)
+                summary_store.save(channel_key, state)
+                continue
+            with metrics.time("swarm_run"):
+                prompt = related + state.build_prompt(packed.text)
+                if summary_pipeline == "dag":
+                    summary = await run_topic_dag(prompt)
+                else:
+                    summary = await llm_pool.run(unless_superseded(message_data, run_swarm_summary), prompt)
+            state.advance(summary, chunk)
+            summary_store.save(channel_key, state)
+            histories.append(packed.text)
+            related = ""
+        if not histories:
+            return None, ''
+        if summary_store.needs_compaction(state):
+            summary_store.compacted(state, await llm_pool.run(run_summary_compaction, state.summary))
+            summary_store.save(channel_key, state)
+        return state.summary, "\n\n".join(histories)
+
+
+async def process_message_history(message_data, destination_channel, pipeline=PIPELINE_FOUNDER_REPLY):
+    llm_calls = count_llm_calls()
+    try:
+        logger.debug("processing history", extra={"channel": message_data.msg_list[0]['guild_channel'], "messages": len(message_data.msg_list)})
+        use_group_chat = pipeline == PIPELINE_FOUNDER_REPLY
+        if use_group_chat:
+            check_superseded(message_data)
+            summary, all_history = await update_channel_summary(message_data)
+            if summary is None:
+                logger.debug("no new messages", extra={"channel": message_data.msg_list[0]['guild_channel']})
+                return
+            logger.debug("new history", extra={"history_chars": len(all_history)})
+            if wait_for_teachability and not teachability.is_ready:
+                await teachability.ready.wait()
+            with metrics.time("founder_reply"):
+                if reply_mode == "structured":
+                    reply_summary = await llm_pool.run(unless_superseded(message_data, run_structured_founder_reply), summary)
+                else:
+                    reply_summary = await llm_pool.run(unless_superseded(message_data, run_founder_reply), summary)
+            logger.info("founder reply done", extra={"llm_cache": llm_cache.stats()})
+            try:
+                parsed_json = json.loads(reply_summary)  # Invalid JSON (extra comma)
+                if parsed_json['need_human_reply_score'] > -1:
+                    logger.info("need human reply", extra={"score": parsed_json['need_human_reply_score']})
+                    msg = f'Received message from server: {all_history} Suggested reply: {reply_summary}'
+                    # split into messages of at most 2000 characters
+                    await send_scheduler.send(destination_channel, msg)
+                else:
+                    logger.info("no human reply needed", extra={"score": parsed_json['need_human_reply_score']})
+                    try:
+                        await private_to_public_writer.send(parsed_json['response'])
+                    except Exception:
+                        logger.exception("error sending reply to pipe")
+            except json.JSONDecodeError as e:
+                logger.warning("founder reply is not json", extra={"error": str(e)})
+        else:
+            packed = history_packer.pack(message_data.msg_list)
+            with metrics.time("history_analysis"):
+                analysis = await llm_pool.run(unless_superseded(message_data, run_history_analysis), packed.text)
+            logger.debug("analysis done", extra={"analysis_chars": len(analysis or "")})
+            guild_channel = message_data.msg_list[0].guild_channel
+            await send_scheduler.send(destination_channel, f"Analysis of the latest messages of {guild_channel}:\n{analysis}")
+    except Superseded:
+        logger.info("dropping superseded history", extra={"channel": message_data.msg_list[0]['guild_channel']})
+        metrics.count("superseded_histories")
+    except LLMJobTimeout as e:
+        logger.warning("LLM pipeline timed out", extra={"error": str(e)})
+    except InvalidReply as e:
+        metrics.count("invalid_replies")
+        logger.warning("founder reply dropped", extra={"error": str(e)})
+    except Exception:
+        logger.exception("error processing history")
+    finally:
+        # only channels with a history in flight are kept
+        channel_id = message_data.msg_list[0].channel_id
+        if latest_history_by_channel.get(channel_id) is message_data:
+            del latest_history_by_channel[channel_id]
+        metrics.count("pipeline_events")
+        logger.info("history processed", extra={"llm_calls": llm_calls.calls})
 
 
 async def listen_public_pipe_message(client):
     await client.wait_until_ready()  # Wait until the bot is fully ready
     pipe_name_public_to_private = sys.argv[2]
-    print(f"pipe_name from bot_in_private: {pipe_name_public_to_private}")
+    logger.info("listening", extra={"pipe": pipe_name_public_to_private})
+    pipe_reader = await open_reader(pipe_name_public_to_private)
 
-    general_channel = None
+    logger.info("destination channels resolved", extra={"destinations": routing.refresh(client)})
 
     while True:
-        if general_channel is None:
-            for guild in client.guilds:
-                print(f'Private Guild: {guild.name}')
-                for channel in guild.text_channels:
-                    if channel.name == 'general':
-                        general_channel = channel
-                        print(f'Found general channel: {general_channel.name}')
-                    print(f'guild:{guild.name}, channel: {channel.name}')
-        else:
-            print(f"general_channel: {general_channel}")
         try:
-            print(f"inside background_task, pipe_name: {pipe_name_public_to_private}")
-            message_data = await async_pickle_load(pipe_name_public_to_private) 
-            print(f"Processing message from pipe in private: {message_data.msg_list}")
-            last_msg = message_data.msg_list[0]['content']
-            history = message_data.msg_list[0]['content']
-            all_history = ''
-            for msg in message_data.msg_list:
-                all_history += 'author:' + msg['author'] + ' content:' + msg['content'] + '\n'
-            print(f"all_history: {all_history}")
-
-            use_group_chat = True
-            if use_group_chat:
-                chat_result, context_variables, last_agent = initiate_swarm_chat(
-                    initial_agent=conversation_split,
-                    agents=[conversation_split, topic_group, business_theme_agent],
-                    messages="Please summarize the chat history." + all_history,
-                    #context_variables=shared_context,
-                )
-                reply_result = user_proxy_agent.initiate_chat(
-                    founder_actor_agent,
-                    message=f"Please try to reply to the message based on the chat history summary.  {chat_result.summary}. ",
-                    summary_method="reflection_with_llm",
-                    max_turns=1,
-                )
-                print(f"reply_result: {reply_result.summary}")
-                try:
-                    parsed_json = json.loads(reply_result.summary)  # Invalid JSON (extra comma)
-                    if parsed_json['need_human_reply_score'] > -1:
-                        print(f'need_human_reply')
-                        msg = f'Received message from server: {all_history} Suggested reply: {reply_result.summary}'
-                        await general_channel.send(msg[:1900])
-                        # at most 2000 characters
-                    else:
-                        print(f'no need_human_reply')
-                        pipe_name_private_to_public = sys.argv[3]
-                        print(f"pipe_name from bot_in_private: {pipe_name_private_to_public}")
-
-                        if not os.path.exists(pipe_name_private_to_public):
-                            os.mkfifo(pipe_name_private_to_public)
-                        try:
-                            with open(pipe_name_private_to_public, "wb") as pipe:
-                                print(f"pipe_name opened: {pipe_name_private_to_public}")
-                                pickle.dump(parsed_json['response'],pipe)
-                            print(f"AI Reply Message sent to pipe in private:: {parsed_json['response']}")
-                        except Exception as e:
-                            print(f"Error sending message to pipe in private: {e}")
-                except json.JSONDecodeError as e:
-                    print(f"JSON parsing error: {e}")
-            else:
-                chat_result = founder_actor_agent.generate_reply(
-                    summary_method="reflection_with_llm",
-                    max_turns=2,
-                    messages=[{"role": "user",
-                            "content": f"Please analyze the chat or chat history: {history}"}]
-                )
-
-                print(f"chat_result: {chat_result}")
-                await general_channel.send('Received message from server:' + str('test') + ' summary: ' + chat_result.summary)
-
-        except Exception as e:
-            print(f"Error processing message in private: {e}")
-            print(f"stack trace: {traceback.format_exc()}")
-            print(f"e.message: {e.message}")
+            # recv() also sets the correlation id of the frame, the pipeline
+            # task created below inherits it
+            message_data = await pipe_reader.recv()
+            if not message_data.msg_list:
+                continue
+            if retriever is not None:
+                retriever.ingest(message_data.msg_list)
+            first = message_data.msg_list[0]
+            route = routing.route_for(first.guild_id, first.channel_id)
+            destination_channel = routing.destination(route) if route is not None else None
+            if route is not None and destination_channel is None:
+                routing.refresh(client)  # the channel may have been created since
+                destination_channel = routing.destination(route)
+            if destination_channel is None:
+                logger.warning("no destination channel for history", extra={"route": repr(route)})
+                metrics.count("unrouted_histories")
+                continue
+            latest_history_by_channel[first.channel_id] = message_data
+            # the pipeline runs on the llm pool, keep reading the pipe meanwhile
+            task = asyncio.create_task(process_message_history(message_data, destination_channel, route.pipeline))
+            pipeline_tasks.add(task)
+            task.add_done_callback(pipeline_tasks.discard)
+        except Exception:
+            logger.exception("error reading from pipe")
             await asyncio.sleep(1)  # Prevent excessive CPU usage
 
 # Schedule background task before starting the bot
 async def main():
+    heartbeat.start_from_env()  # lets the supervisor in main.py detect a stuck loop
+    await start_metrics_from_env()
+    await history_packer.warm_up()
+    await related_packer.warm_up()
+    metrics.gauge("ipc_outbox", lambda: private_to_public_writer.pending)
+    metrics.gauge("pipeline_tasks", lambda: len(pipeline_tasks))
+    metrics.gauge("send_queue", lambda: send_scheduler.pending)
+    metrics.gauge("llm_pool_running", lambda: llm_pool.running)
+    metrics.gauge("llm_pool_waiting", lambda: llm_pool.waiting)
+    private_to_public_writer.start()
+    if retriever is not None:
+        asyncio.create_task(retriever.flush_forever())  # embed new messages in batches
     asyncio.create_task(listen_public_pipe_message(client))  # Run in parallel
     await client.start(TOKEN)  # Replaces client.run()
 
-asyncio.run(main())  # Start everything
+# imported by benchmarks/bench_e2e.py without connecting to Discord
+if __name__ == "__main__":
+    asyncio.run(main())  # Start everything
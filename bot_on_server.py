@@ -1,18 +1,29 @@
 import asyncio
+import collections
+import logging
 import os
-import pickle
 import sys
 import aiohttp
 from dotenv import load_dotenv
 import discord
 from discord.ext import commands
 from discord import app_commands
-import autogen
-import os
-from autogen import AssistantAgent, ConversableAgent
-from utils import download_channel_history, find_original_thread, async_pickle_load # type: ignore
-# AFTER_WORK, ON_CONDITION, AfterWorkOption
-from autogen.agentchat.contrib.swarm_agent import SwarmResult, initiate_swarm_chat
+# autogen is heavy to import, the agent registry loads it when /summarize
+# first needs an agent
+from agent_registry import AgentRegistry
+from utils import backfill_channel, download_channel_history, message_to_record # type: ignore
+from ipc import open_reader, writer_from_env
+import heartbeat
+from metrics import metrics, start_from_env as start_metrics_from_env
+from llm_pool import LLMJobTimeout, pool_from_env
+from history_cache import ChannelHistoryCache
+from message_store import store_from_env
+from debounce import debouncer_from_env
+from prompt_packing import packer_from_env
+from logging_setup import correlation_id, setup_logging
+from routing import routing_from_env
+from triage import triage_from_env
+from progress_message import ProgressMessage
 #from data_process import DataProcesser
 
 import data_definition
@@ -20,55 +31,43 @@ from data_definition import MessageHistory
 
 #   source ./venv/bin/activate
 
-class DataProcesser:
-    def __init__(self) -> None:
-        pass
-        
-    def process(self, msg):
-        msgstr = '[' + msg['timestamp'] + '] ' + msg['author'] + ': ' + msg['content'] + '\n'
-
-        return msgstr
-
-
 # rudy server token
 
 env_file = sys.argv[1]
 load_dotenv(dotenv_path=env_file, override=True)
 open_ai_key = os.environ["OPENAI_API_KEY"]
-config_list = [{"model": "gpt-4", "api_key": open_ai_key}]
 
-# create an AssistantAgent instance named "assistant" with the LLM configuration.
-assistant = AssistantAgent(name="assistant", llm_config={"config_list": config_list})
+setup_logging("bot_on_server")
+logger = logging.getLogger("bot_on_server")
 
-def history_split(context_variables: dict) -> SwarmResult:
+def history_split(context_variables: dict):
     """Record the lesson plan"""
+    from autogen.agentchat.contrib.swarm_agent import SwarmResult
 
     # Returning the updated context so the shared context can be updated
     return SwarmResult(context_variables=context_variables)
 
-conversation_split = ConversableAgent(
-    name="conversation_split",
-    system_message="You are a expert who can split the conversation history from several part. each part is a whole conversation of a topic.",
-    llm_config={"config_list": [{"model": "gpt-4", "api_key": open_ai_key}]},
-    functions=[history_split]
-)
-topic_group = ConversableAgent(
-    name="topic_group",
-    system_message="you are a expert who can summarize the conversation topic and aggregate the same topic",
-    llm_config={"config_list": [{"model": "gpt-4", "api_key": open_ai_key}]},
-)
-
-
-user_proxy_agent = ConversableAgent(
-    name="UserProxyAgent",
-    system_message="You are a user who want to analyze the business themes from the discord channel.",
-    llm_config={"config_list": [{"model": "gpt-4", "api_key": open_ai_key}]},
-)
-assistant_agent = ConversableAgent(
-    name="AsistantAgent",
-    system_message="You are a business analyst who excels at discovering business themes in conversation transcripts.",
-    llm_config={"config_list": [{"model": "gpt-4", "api_key": open_ai_key}]},
-)
+AGENT_SPECS = {
+    "conversation_split": {
+        "system_message": "You are a expert who can split the conversation history from several part. each part is a whole conversation of a topic.",
+        "model": "gpt-4",
+        "functions": [history_split],
+    },
+    "topic_group": {
+        "system_message": "you are a expert who can summarize the conversation topic and aggregate the same topic",
+        "model": "gpt-4",
+    },
+    "UserProxyAgent": {
+        "system_message": "You are a user who want to analyze the business themes from the discord channel.",
+        "model": "gpt-4",
+    },
+    "AsistantAgent": {
+        "system_message": "You are a business analyst who excels at discovering business themes in conversation transcripts.",
+        "model": "gpt-4",
+    },
+}
+
+agents = AgentRegistry(AGENT_SPECS, open_ai_key, base_url=os.getenv("OPENAI_BASE_URL"))
 
 
 TOKEN = os.getenv("DISCORD_BOT_TOKEN")
@@ -84,23 +83,57 @@ intents.message_content = True
 client = discord.Client(intents=intents)
 tree = app_commands.CommandTree(client)
 
+# one long-lived framed stream to each private worker, argv[2] and argv[3] are
+# comma separated when main.py runs several (PRIVATE_WORKERS)
+public_to_private_writers = [writer_from_env(pipe_name) for pipe_name in sys.argv[2].split(",")]
+# which channels are watched, and which private worker gets their history
+routing = routing_from_env()
+# cheap local filter in front of the agent pipeline, None forwards everything
+triage = triage_from_env()
+
+# agent pipelines run here, off the event loop
+llm_pool = pool_from_env()
+# /summarize results per history window, least recently used dropped first
+summary_cache = collections.OrderedDict()
+summary_cache_size = int(os.getenv("SUMMARY_CACHE_SIZE", "32"))
+summary_history_limit = int(os.getenv("SUMMARY_HISTORY_LIMIT", "100"))
+history_packer = packer_from_env()
+
+# keep recent history per channel, so on_message only pulls the new messages
+history_cache = ChannelHistoryCache(
+    max_channels=int(os.getenv("HISTORY_CACHE_CHANNELS", "32")),
+    max_messages=int(os.getenv("HISTORY_CACHE_MESSAGES", "200")),
+)
+# local sqlite copy of the channels fed by the gateway, replaces the cache and
+# the REST reads when enabled
+message_store = store_from_env()
+
 
 @client.event
 async def on_ready():
-    print(TOKEN)
-    print(f'Logged in as {client.user}!')
-
-    for guild in client.guilds:
-          for channel in guild.text_channels:
-              print(f'guild:{guild.name}, channel: {channel.name}')
-    print(f'Logged in as {client.user}!')
+    logger.info("logged in", extra={
+        "user": str(client.user),
+        "channels": [f"{guild.name}/{channel.name}" for guild in client.guilds for channel in guild.text_channels],
+    })
     await tree.sync()
+    if message_store is not None:
+        asyncio.create_task(backfill_routed_channels())
 
     #await client.close()
 
+async def backfill_routed_channels():
+    for guild in client.guilds:
+        for channel in guild.text_channels:
+            if routing.route_for(guild.id, channel.id) is None:
+                continue
+            try:
+                await backfill_channel(message_store, guild, channel)
+            except discord.DiscordException:
+                logger.exception("backfill failed", extra={"channel": channel.name})
+
 @tree.command(name="tell-me-a-joke", description="Get a random dad joke")
 async def tell_me_a_joke(interaction: discord.Interaction):
-  print(f"interaction: {interaction}")
+  logger.debug("joke requested", extra={"user": str(interaction.user)})
   async with aiohttp.ClientSession() as session:
     site = await session.get(
         "https://icanhazdadjoke.com/",
@@ -111,25 +144,21 @@ async def tell_me_a_joke(interaction: discord.Interaction):
   data = await site.json()
   #await interaction.response.send_message(data["joke"])
 
-@tree.command(name="summarize", description="Summarize the history")
-async def summarize(interaction: discord.Interaction):
-  print(f"interaction: {interaction}")
-  data_processer = DataProcesser()
-  msg_list,msg_dict = await download_channel_history(client, GUILD, CHANNEL)
-
-  history = ''
-  for msgid, msg in msg_dict.items():
-      print(msg)
-    #   msgstr = 'timestamp:' + msg['timestamp'] + ', author:' + msg['author'] + ', content: ' + msg['content'] + '\n'
-      msgstr = data_processer.process(msg)
-      history+= msgstr
-
-  print(history)
-
-
-  #await interaction.response.send_message('got all messages')
+def run_summary_group_chat(history, on_agent_message=None):
+  # blocking, runs on the llm pool. Fresh agents per summary, so summaries can
+  # run at the same time and the progress hooks never pile up on shared agents.
+  import autogen
+
+  user_proxy_agent = agents.build("UserProxyAgent")
+  chat_agents = [agents.build("conversation_split"), agents.build("topic_group"), agents.build("AsistantAgent")]
+  if on_agent_message is not None:
+    for agent in chat_agents:
+      def hook(sender, message, recipient, silent):
+        on_agent_message(sender.name, message.get("content") if isinstance(message, dict) else message)
+        return message
+      agent.register_hook("process_message_before_send", hook)
   groupchat = autogen.GroupChat(
-    agents=[user_proxy_agent, conversation_split, topic_group, assistant_agent], messages=[], max_round=4, speaker_selection_method='round_robin'
+    agents=[user_proxy_agent] + chat_agents, messages=[], max_round=4, speaker_selection_method='round_robin'
     )
   manager = autogen.GroupChatManager(groupchat=groupchat, llm_config={"config_list": [{"model": "gpt-4o-mini", "api_key": open_ai_key}]})
   chat_result = user_proxy_agent.initiate_chat(
@@ -138,19 +167,91 @@ async def summarize(interaction: discord.Interaction):
       summary_method="reflection_with_llm",
       max_turns=1,
   )
-  # TODO, post a message, got message id, update message
-  
-  # await interaction.response.send_message(chat_result.summary)
+  return chat_result.summary
 
 
-  #print(msgs)
+def summary_window(msg_list):
+  # the same messages give the same summary
+  ids = [msg.id for msg in msg_list]
+  return (msg_list[0].channel_id, min(ids), max(ids), len(ids)) if ids else None
+
+
+@tree.command(name="summarize", description="Summarize the history")
+async def summarize(interaction: discord.Interaction):
+  if interaction.guild is None:
+    # no guild history to read in a DM, answer before deferring
+    await interaction.response.send_message("/summarize works in server channels only.", ephemeral=True)
+    return
+  # Discord gives an interaction 3 seconds, defer first and follow up later
+  await interaction.response.defer(thinking=True)
+  logger.info("summarize requested", extra={"user": str(interaction.user)})
+  progress = None
+
+  async def fail(text):
+    # the deferred interaction must always get an answer
+    if progress is None:
+      await interaction.followup.send(text)
+    else:
+      await progress.finish(text)
+
+  try:
+    with metrics.time("history_fetch"):
+      msg_list,msg_dict = await download_channel_history(
+        client, interaction.guild, interaction.channel, limit=summary_history_limit, cache=history_cache,
+        store=message_store)
+
+    window = summary_window(msg_list)
+    if window is None:
+      await interaction.followup.send("Nothing to summarize.")
+      return
+    summary = summary_cache.get(window)
+    if summary is not None:
+      summary_cache.move_to_end(window)
+      metrics.count("summary_cache_hits")
+      progress = await ProgressMessage(interaction).start("Summary of the last messages (cached):")
+      await progress.finish(summary)
+      return
+
+    packed = history_packer.pack(msg_list)
+    history = packed.text
+    logger.debug("packed history", extra={"tokens_used": packed.tokens_used, "messages_used": packed.messages_used})
+
+    progress = await ProgressMessage(interaction).start(f"Summarizing {packed.messages_used} messages...")
+    loop = asyncio.get_running_loop()
+    done = []
+
+    def on_agent_message(agent_name, content):
+      # called in the llm pool thread each time an agent answers
+      done.append(agent_name)
+      text = "\n".join(f"{name} done" for name in done) + f"\n\n**{agent_name}**: {content or ''}"
+      loop.call_soon_threadsafe(progress.update, text)
+
+    with metrics.time("summary_group_chat"):
+      summary = await llm_pool.run(run_summary_group_chat, history, on_agent_message)
+    logger.info("summary done", extra={"summary_chars": len(summary or "")})
+    summary = summary or "Nothing to summarize."
+    summary_cache[window] = summary
+    while len(summary_cache) > summary_cache_size:
+      summary_cache.popitem(last=False)
+    await progress.finish(summary)
+  except LLMJobTimeout as e:
+    logger.warning("summarize timed out", extra={"error": str(e)})
+    await fail("Sorry, the summary took too long.")
+  except Exception:
+    logger.exception("summarize failed")
+    await fail("Sorry, the summary failed.")
 
 
 
 @client.event
 async def on_message(message):
+    metrics.count("gateway_messages")
+    # every log line and pipe frame caused by this message carries its id
+    correlation_id.set(str(message.id))
     message_guild = message.guild
     message_channel = message.channel
+    if message_store is not None and message_guild is not None:
+        message_store.ingest(message_to_record(message, message_guild, message_channel))
     
     founder_list = ['rudyrrr'] # to update
 
@@ -158,39 +259,69 @@ async def on_message(message):
         return
     if message.author in founder_list:  # ignore the message from the founder
         return
-    if "@" in message.content:  # ignore the message from the founder
-        # Extract user ID from message
-        content = message.content
-        start_idx = content.find('@') + 1
-        end_idx = content.find(' ', start_idx) if ' ' in content[start_idx:] else len(content)
-        mentioned_user = content[start_idx:end_idx]
-        if mentioned_user not in founder_list:
-            print(f"Mentioned user: {mentioned_user}")
-            #return
-    
-    print(f"Message received: {message.content}, author: {message.author}, user: {client.user}")
-    channel = message.channel
-    pipe_name_public_to_private = sys.argv[2]
-    print(f"pipe_name from bot_on_server: {pipe_name_public_to_private}")
+    if message_guild is None or routing.route_for(message_guild.id, message_channel.id) is None:
+        metrics.count("unrouted_messages")
+        return
+    if triage is not None:
+        decision = triage.evaluate(message, client.user)
+        if not decision.forward:
+            logger.debug("triage dropped message", extra={"score": decision.score})
+            return
+        logger.debug("triage forwarded message", extra={"score": decision.score, "reasons": decision.reasons})
 
-    msg_list,msg_dict = await download_channel_history(client, message_guild, message_channel)
+    logger.debug("message received", extra={"author": str(message.author), "channel": message_channel.name})
+    # a burst of messages in a channel is forwarded once, with the latest history
+    channel_debouncer.submit(message_channel.id, message)
 
-    print(f"msg_list: {msg_list}")
 
-    if not os.path.exists(pipe_name_public_to_private):
-        os.mkfifo(pipe_name_public_to_private)
+async def forward_channel_history(message, burst_size):
+    message_guild = message.guild
+    message_channel = message.channel
+    logger.info("forwarding history", extra={"channel": message_channel.name, "burst_size": burst_size})
+
+    metrics.count("coalesced_messages", burst_size - 1)
     try:
-        with open(pipe_name_public_to_private, "wb") as pipe:
-            print(f"pipe_name opened: {pipe_name_public_to_private}")
-            one_message = MessageHistory(msg_list,msg_dict)
-            pickle.dump(one_message,pipe)
-        print(f"Message sent to pipe: {message.content}")
-    except Exception as e:
-        print(f"Error sending message to pipe in server: {e}")
+        # every message of the burst, so none of them misses the summary
+        with metrics.time("history_fetch"):
+            msg_list,msg_dict = await download_channel_history(
+                client, message_guild, message_channel, limit=max(5, burst_size), cache=history_cache,
+                store=message_store)
+
+        logger.debug("history downloaded", extra={"messages": len(msg_list)})
+
+        one_message = MessageHistory(msg_list,msg_dict)
+        worker = routing.worker_for(message_guild.id, message_channel.id, len(public_to_private_writers))
+        await public_to_private_writers[worker].send(one_message)
+        logger.debug("history sent to pipe")
+    except Exception:
+        logger.exception("error forwarding history")
+
+    #await message_channel.send('Echo from server:' + message.content)
 
-    #await channel.send('Echo from server:' + message.content)
+channel_debouncer = debouncer_from_env(forward_channel_history)
+
+
+@client.event
+async def on_raw_message_edit(payload):
+    history_cache.apply_edit(payload.channel_id, payload.message_id, payload.data.get("content"))
+    if message_store is not None:
+        message_store.edit(payload.message_id, payload.data.get("content"))
+
+
+@client.event
+async def on_raw_message_delete(payload):
+    history_cache.apply_delete(payload.channel_id, payload.message_id)
+    if message_store is not None:
+        message_store.delete(payload.message_id)
+
+
+@client.event
+async def on_raw_bulk_message_delete(payload):
+    for message_id in payload.message_ids:
+        history_cache.apply_delete(payload.channel_id, message_id)
+        if message_store is not None:
+            message_store.delete(message_id)
 
-print(f"TOKEN in bot_on_server: {TOKEN}")
 
 @client.event
 async def setup_hook():
@@ -199,46 +330,39 @@ async def setup_hook():
 
 
 
-# not working
-#with open(pipe_name_private_to_public, "rb") as pipe:
-#               print(f"pipe opened server: {pipe}")
-#              message_data = await async_pickle_load2(pipe)
-async def async_pickle_load2(pipe):
-    """Runs pickle.load() asynchronously using a separate thread."""
-    return await asyncio.to_thread(pickle.load, pipe)  # Non-blocking
-
-async def listen_private_pipe_message(client):
+async def listen_private_pipe_message(client, pipe_name_private_to_public):
     await client.wait_until_ready()  # Wait until the bot is fully ready
-    pipe_name_private_to_public = sys.argv[3]
-    print(f"pipe_name from bot_on_server: {pipe_name_private_to_public}")
-
-    general_channel = None
+    logger.info("listening", extra={"pipe": pipe_name_private_to_public})
+    pipe_reader = await open_reader(pipe_name_private_to_public)
 
     while True:
-        if general_channel is None:
-            for guild in client.guilds:
-                print(f'Server Guild: {guild.name}')
-                for channel in guild.text_channels:
-                    if channel.name == 'general':
-                        general_channel = channel
-                        print(f'Found general channel on server: {general_channel.name}')
-                    print(f'guild:{guild.name}, channel: {channel.name}')
-            print(f"general_channel: {general_channel}")
-        else:
-            print(f"general_channel: {general_channel}")
         try:
-            print(f"inside server background_task, pipe_name: {pipe_name_private_to_public}")
-            message_data = await async_pickle_load(pipe_name_private_to_public) 
+            message_data = await pipe_reader.recv()
 
-            print(f"Processing message from pipe in server: {message_data}")
-            # await general_channel.send('Received message from private in server:' + str(message_data))
-        except Exception as e:
-            print(f"Error processing message in server: {e}")
+            logger.debug("message from private bot", extra={"message_type": type(message_data).__name__})
+        except Exception:
+            logger.exception("error processing message in server")
             await asyncio.sleep(1)  # Prevent excessive CPU usage
 
 # Schedule background task before starting the bot
 async def main():
-    # asyncio.create_task(listen_private_pipe_message(client))  # Run in parallel
+    heartbeat.start_from_env()  # lets the supervisor in main.py detect a stuck loop
+    await start_metrics_from_env()
+    await history_packer.warm_up()
+    metrics.gauge("ipc_outbox", lambda: sum(writer.pending for writer in public_to_private_writers))
+    metrics.gauge("debounce_pending", lambda: len(channel_debouncer))
+    metrics.gauge("llm_pool_running", lambda: llm_pool.running)
+    metrics.gauge("llm_pool_waiting", lambda: llm_pool.waiting)
+    if message_store is not None:
+        message_store.start()
+        metrics.gauge("store_pending", lambda: message_store.pending)
+    for writer in public_to_private_writers:
+        writer.start()
+    # keep the private -> public pipes drained, so no private worker waits on them
+    for pipe_name in sys.argv[3].split(","):
+        asyncio.create_task(listen_private_pipe_message(client, pipe_name))  # Run in parallel
     await client.start(TOKEN)  # Replaces client.run()
 
-asyncio.run(main())  # Start everything
\ No newline at end of file
+# imported by benchmarks/bench_e2e.py without connecting to Discord
+if __name__ == "__main__":
+    asyncio.run(main())  # Start everything
@@ -0,0 +1,64 @@
+import asyncio
+import inspect
+import time
+
+from metrics import metrics
+
+
+class DagExecutor:
+    """Runs pipeline steps as a graph, each step as soon as its inputs are done.
+
+    add(name, fn, deps) schedules a step; fn gets the results of deps as
+    arguments. Blocking functions (agent calls) are handed to run_blocking,
+    e.g. llm_pool.run, and at most max_concurrency of them run at once.
+    Coroutine functions run on the loop without a slot and get the executor
+    as first argument, so they can fan out: add one step per item of a
+    result and a reduce step over them, while the graph is running.
+
+    Each step is timed into timings and the metrics stage dag:<name up to ":">.
+    If a step fails, the steps still running are cancelled and wait() raises.
+    """
+
+    def __init__(self, run_blocking, max_concurrency=4):
+        self.run_blocking = run_blocking
+        self.timings = {}
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._tasks = {}
+
+    def add(self, name, fn, deps=()):
+        if name in self._tasks:
+            raise ValueError(f"duplicate step: {name}")
+        missing = [dep for dep in deps if dep not in self._tasks]
+        if missing:
+            raise ValueError(f"step {name} depends on unknown steps: {missing}")
+        task = asyncio.create_task(self._run_step(name, fn, [self._tasks[dep] for dep in deps]))
+        self._tasks[name] = task
+        return task
+
+    async def _run_step(self, name, fn, dep_tasks):
+        inputs = await asyncio.gather(*dep_tasks)
+        if inspect.iscoroutinefunction(fn):
+            start = time.perf_counter()
+            result = await fn(self, *inputs)
+        else:
+            async with self._slots:
+                start = time.perf_counter()
+                result = await self.run_blocking(fn, *inputs)
+        seconds = time.perf_counter() - start
+        self.timings[name] = seconds
+        metrics.observe(f"dag:{name.split(':')[0]}", seconds)
+        return result
+
+    async def wait(self):
+        """Waits for every step, including the ones added meanwhile; returns name -> result."""
+        try:
+            while True:
+                pending = [task for task in self._tasks.values() if not task.done()]
+                if not pending:
+                    break
+                await asyncio.gather(*pending)
+            return {name: task.result() for name, task in self._tasks.items()}
+        except BaseException:
+            for task in self._tasks.values():
+                task.cancel()
+            raise
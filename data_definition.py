@@ -1,5 +1,120 @@
+import sys
+
+from thread_index import group_by_thread
+
+
+class MessageRecord:
+    """One normalized Discord message.
+
+    Slotted to keep large histories small: author and guild_channel are
+    interned, so every message of the same author or channel shares one string,
+    and the message link is derived on access instead of stored. Item access
+    (record["content"]) keeps working for code written against the old dicts.
+    """
+
+    __slots__ = (
+        "id",
+        "author",
+        "content",
+        "timestamp",
+        "guild_id",
+        "channel_id",
+        "guild_channel",
+        "is_reply",
+        "author_is_bot",
+        "reply_to_message_id",
+        "original_thread_id",
+    )
+
+    def __init__(self, id, author, content, timestamp, guild_id, channel_id, guild_channel,
+                 is_reply=False, author_is_bot=False, reply_to_message_id=None, original_thread_id=None):
+        self.id = id
+        self.author = sys.intern(author)
+        self.content = content
+        self.timestamp = timestamp
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.guild_channel = sys.intern(guild_channel)
+        self.is_reply = is_reply
+        self.author_is_bot = author_is_bot
+        self.reply_to_message_id = reply_to_message_id
+        self.original_thread_id = original_thread_id
+
+    @property
+    def is_thread(self):
+        # Major thread if no reference
+        return not self.is_reply
+
+    @property
+    def link(self):
+        return f"https://discord.com/channels/{self.guild_id}/{self.channel_id}/{self.id}"
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def __repr__(self):
+        return f"MessageRecord(id={self.id}, author={self.author!r}, content={self.content!r})"
+
+    def to_dict(self):
+        # the json export format of download_channel_history records
+        msg = {
+            "id": str(self.id),
+            "author": self.author,
+            "content": self.content,
+            "timestamp": self.timestamp,
+            "link": self.link,
+            "is_thread": self.is_thread,
+            "is_reply": self.is_reply,
+            "author_is_bot": self.author_is_bot,
+            "guild_channel": self.guild_channel,
+            "original_thread_id": self.original_thread_id,
+        }
+        if self.reply_to_message_id is not None:
+            msg["reply_to_message_id"] = self.reply_to_message_id
+        return msg
+
+
 class MessageHistory:
-    def __init__(self, msg_list: list, msg_dict: dict):
+    def __init__(self, msg_list: list, msg_dict: dict = None):
+        # msg_dict is an id lookup over the same records as msg_list
         self.msg_list = msg_list
-        self.msg_dict = msg_dict
+        self.msg_dict = msg_dict if msg_dict is not None else {msg.id: msg for msg in msg_list}
+
+    def threads(self):
+        # thread root id -> messages of the thread, oldest first
+        return group_by_thread(self.msg_list)
+
+    def to_dict(self):
+        # compact form for the pipe: one row per message, strings repeated
+        # across messages (authors, channels) are sent once
+        strings = {}
+        rows = []
+        for msg in self.msg_list:
+            author = strings.setdefault(msg.author, len(strings))
+            guild_channel = strings.setdefault(msg.guild_channel, len(strings))
+            rows.append([
+                msg.id, author, msg.content, msg.timestamp, msg.guild_id, msg.channel_id, guild_channel,
+                msg.is_reply, msg.author_is_bot, msg.reply_to_message_id, msg.original_thread_id,
+            ])
+        return {"strings": list(strings), "rows": rows}
 
+    @classmethod
+    def from_dict(cls, data):
+        strings = data["strings"]
+        msg_list = []
+        for (id, author, content, timestamp, guild_id, channel_id, guild_channel,
+             is_reply, author_is_bot, reply_to_message_id, original_thread_id) in data["rows"]:
+            msg_list.append(MessageRecord(
+                id, strings[author], content, timestamp, guild_id, channel_id, strings[guild_channel],
+                is_reply, author_is_bot, reply_to_message_id, original_thread_id,
+            ))
+        return cls(msg_list)
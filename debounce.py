@@ -0,0 +1,68 @@
+import asyncio
+import os
+
+
+class _PendingBatch:
+    def __init__(self, payload, first_at):
+        self.payload = payload
+        self.first_at = first_at
+        self.count = 1
+        self.timer = None
+
+
+class ChannelDebouncer:
+    """Collapses bursts of triggers per channel into one callback.
+
+    submit() (re)starts a quiet-period timer for the key and keeps only the
+    latest payload, earlier ones are superseded. The callback fires once the key
+    has been quiet for quiet_period seconds, or max_wait seconds after the first
+    trigger of the burst, whichever comes first.
+    """
+
+    def __init__(self, callback, quiet_period=3.0, max_wait=15.0):
+        self.callback = callback
+        self.quiet_period = quiet_period
+        self.max_wait = max_wait
+        self.fired = 0
+        self.superseded = 0
+        self._pending = {}  # key -> _PendingBatch
+        self._tasks = set()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def submit(self, key, payload):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = self._pending[key] = _PendingBatch(payload, now)
+        else:
+            batch.timer.cancel()
+            batch.payload = payload
+            batch.count += 1
+            self.superseded += 1
+        delay = min(self.quiet_period, self.max_wait - (now - batch.first_at))
+        batch.timer = loop.call_later(max(delay, 0), self._fire, key)
+
+    def _fire(self, key):
+        batch = self._pending.pop(key, None)
+        if batch is None:
+            return
+        self.fired += 1
+        task = asyncio.create_task(self.callback(batch.payload, batch.count))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def cancel(self, key):
+        batch = self._pending.pop(key, None)
+        if batch is not None:
+            batch.timer.cancel()
+
+
+def debouncer_from_env(callback):
+    return ChannelDebouncer(
+        callback,
+        quiet_period=float(os.getenv("DEBOUNCE_QUIET_SECONDS", "3")),
+        max_wait=float(os.getenv("DEBOUNCE_MAX_WAIT_SECONDS", "15")),
+    )
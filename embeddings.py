@@ -0,0 +1,33 @@
+import math
+import re
+import zlib
+
+_WORD = re.compile(r"\w+")
+
+
+def cosine(a, b):
+    # vectors from the embedders here are l2 normalised
+    return sum(x * y for x, y in zip(a, b))
+
+
+class HashingEmbedder:
+    """Hashed bag of words and word pairs, l2 normalised.
+
+    Needs no model and no download, and is the same in every process, so it
+    works offline and in the benchmarks. Good enough to tell "asks about
+    pricing" from "thanks!", not a semantic model.
+    """
+
+    def __init__(self, dim=512):
+        self.dim = dim
+
+    def _embed_one(self, text):
+        vector = [0.0] * self.dim
+        words = _WORD.findall(text.lower())
+        for token in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            vector[zlib.crc32(token.encode()) % self.dim] += 1.0
+        norm = math.sqrt(sum(x * x for x in vector))
+        return [x / norm for x in vector] if norm else vector
+
+    def embed(self, texts):
+        return [self._embed_one(text) for text in texts]
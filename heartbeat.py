@@ -0,0 +1,39 @@
+import asyncio
+import os
+import time
+
+# The supervisor in main.py passes each bot a heartbeat file. The bot touches it
+# from its event loop every few seconds; if the file goes stale the loop is
+# stuck (or the process hung) and the supervisor restarts the bot.
+
+HEARTBEAT_FILE_ENV = "BOT_HEARTBEAT_FILE"
+
+
+def touch(path):
+    now = time.time()
+    try:
+        os.utime(path, (now, now))
+    except FileNotFoundError:
+        with open(path, "w"):
+            pass
+
+
+def age(path):
+    try:
+        return time.time() - os.path.getmtime(path)
+    except FileNotFoundError:
+        return None
+
+
+async def beat_forever(path, interval=5.0):
+    while True:
+        touch(path)
+        await asyncio.sleep(interval)
+
+
+def start_from_env():
+    # no-op when the bot was not started by the supervisor
+    path = os.getenv(HEARTBEAT_FILE_ENV)
+    if not path:
+        return None
+    return asyncio.create_task(beat_forever(path, float(os.getenv("HEARTBEAT_INTERVAL", "5"))))
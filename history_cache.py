@@ -0,0 +1,103 @@
+from collections import OrderedDict
+
+from thread_index import ReplyGraphIndex
+
+
+class ChannelHistory:
+    """Normalized message records of one channel, kept oldest first."""
+
+    def __init__(self, max_messages, seeded_limit):
+        self.max_messages = max_messages
+        self.seeded_limit = seeded_limit
+        self.records = OrderedDict()  # message id -> MessageRecord, oldest first
+        self.thread_index = ReplyGraphIndex()
+
+    @property
+    def newest_id(self):
+        if not self.records:
+            return None
+        return next(reversed(self.records))
+
+    def add(self, message_data):
+        message_id = message_data.id
+        if message_id in self.records:
+            # overlapping downloads fetch the same messages, keep their place
+            self.records[message_id] = message_data
+            return
+        newest_id = self.newest_id
+        self.records[message_id] = message_data
+        if newest_id is not None and message_id < newest_id:
+            # rare, keep the records in id order
+            for record_id in sorted(self.records):
+                self.records.move_to_end(record_id)
+        self.thread_index.add(message_id, message_data.reply_to_message_id)
+        while len(self.records) > self.max_messages:
+            self.records.popitem(last=False)
+        if len(self.thread_index) > 4 * self.max_messages:
+            # evicted messages keep the index growing, fold them into the roots
+            self.thread_index.compact(self.records)
+
+    def edit(self, message_id, content):
+        message_data = self.records.get(message_id)
+        if message_data is None:
+            return False
+        message_data.content = content
+        return True
+
+    def delete(self, message_id):
+        return self.records.pop(message_id, None) is not None
+
+    def latest(self, limit):
+        # newest first, same order as channel.history(oldest_first=False)
+        msg_list = []
+        for message_id in reversed(self.records):
+            if len(msg_list) >= limit:
+                break
+            msg_list.append(self.records[message_id])
+        return msg_list
+
+
+class ChannelHistoryCache:
+    """Per-channel history cache with LRU eviction of cold channels.
+
+    The first download of a channel seeds the cache with a full fetch, later
+    downloads only pull messages after the newest cached id. Edits and deletes
+    coming from gateway events are applied in place.
+    """
+
+    def __init__(self, max_channels=32, max_messages=200):
+        self.max_channels = max_channels
+        self.max_messages = max_messages
+        self._channels = OrderedDict()  # channel id -> ChannelHistory
+
+    def __len__(self):
+        return len(self._channels)
+
+    def get(self, channel_id):
+        history = self._channels.get(channel_id)
+        if history is not None:
+            self._channels.move_to_end(channel_id)
+        return history
+
+    def seed(self, channel_id, limit):
+        history = ChannelHistory(max(self.max_messages, limit), limit)
+        self._channels[channel_id] = history
+        self._channels.move_to_end(channel_id)
+        while len(self._channels) > self.max_channels:
+            self._channels.popitem(last=False)
+        return history
+
+    def apply_edit(self, channel_id, message_id, content):
+        history = self._channels.get(channel_id)
+        if history is None or content is None:
+            return False
+        return history.edit(message_id, content)
+
+    def apply_delete(self, channel_id, message_id):
+        history = self._channels.get(channel_id)
+        if history is None:
+            return False
+        return history.delete(message_id)
+
+    def evict(self, channel_id):
+        self._channels.pop(channel_id, None)
@@ -1,4 +1,5 @@
 from utils import download_guild_history_by_name
+from archive import ArchiveReader, write_archive
 from dotenv import load_dotenv
 import discord
 import asyncio
@@ -12,6 +13,8 @@ load_dotenv(dotenv_path=ENV_FILE, override=True)
 DISCORD_BOT_TOKEN = os.getenv('DISCORD_BOT_TOKEN')
 DISCORD_GUILD = os.getenv('DISCORD_GUILD')
 DISCORD_CHANNEL = os.getenv('DISCORD_CHANNEL')
+# 'archive' writes the columnar, memory-mappable format, 'json' the old json dump
+EXPORT_FORMAT = os.getenv('HISTORY_EXPORT_FORMAT', 'archive')
 
 intents = discord.Intents.default()
 intents.members = True
@@ -25,24 +28,31 @@ async def on_ready():
     for guild in client.guilds:
         print(f'Hisotry download Guild: {guild.name}')
 
-    output_file = f'{DISCORD_GUILD}_{DISCORD_CHANNEL}.json'
+    extension = 'dcha' if EXPORT_FORMAT == 'archive' else 'json'
+    output_file = f'{DISCORD_GUILD}_{DISCORD_CHANNEL}.{extension}'
+    msg_list = []
     try:
         msg_list, msg_dict = await download_guild_history_by_name(client, DISCORD_GUILD, DISCORD_CHANNEL, limit=10000)
-        print(f'msg_list: {msg_list}')
         # save to file
-        with open(output_file, 'w') as f:
-            json.dump(msg_list, f, indent=2)
+        if EXPORT_FORMAT == 'archive':
+            write_archive(output_file, msg_list)
+        else:
+            with open(output_file, 'w') as f:
+                json.dump([msg.to_dict() for msg in msg_list], f, indent=2)
         print(f'History download saved to {output_file}')
     except Exception as e:
         print(f'Error during history download: {e}')
     print(f'History download completed {len(msg_list)} messages for {DISCORD_GUILD} - {DISCORD_CHANNEL}')
 
     try:
-        # read the list of messages from the file
-        # and convert to discord.Message objects
-        with open(output_file, 'r') as f:
-            msg_list = json.load(f)
-        print(f'msg_list: {len(msg_list)}')
+        # check the saved file, the archive only reads its header for the count
+        if EXPORT_FORMAT == 'archive':
+            with ArchiveReader(output_file) as reader:
+                print(f'msg_list: {len(reader)}')
+        else:
+            with open(output_file, 'r') as f:
+                msg_list = json.load(f)
+            print(f'msg_list: {len(msg_list)}')
     except Exception as e:
         print(f'Error reading messages from file: {e}')
 
@@ -0,0 +1,300 @@
+import asyncio
+import json
+import logging
+import os
+import struct
+
+from data_definition import MessageHistory
+from logging_setup import correlation_id
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Messages between the two bots go over a FIFO as length-prefixed JSON frames:
+# 4 bytes big-endian payload length, then the UTF-8 JSON envelope
+# {"type": ..., "data": ..., "cid": ...}, where cid is the correlation id of
+# the Discord message that caused the send. Both ends keep the FIFO open for
+# their lifetime, so there is no open/close handshake per message.
+#
+# In single-process mode (python main.py --single-process) both bots run on one
+# event loop. use_memory_transport() switches open_reader() and writer_from_env()
+# to an in-memory queue per pipe name with the same interface: messages are
+# handed over as objects, nothing is encoded and no syscall is made.
+
+FRAME_HEADER = struct.Struct(">I")
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+OVERFLOW_BLOCK = "block"  # wait for room in the outbox
+OVERFLOW_DROP_OLDEST = "drop_oldest"  # drop the oldest pending message
+OVERFLOW_DROP_NEWEST = "drop_newest"  # drop the message being sent
+OVERFLOW_ERROR = "error"  # raise OutboxFull
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST, OVERFLOW_ERROR)
+
+
+class OutboxFull(Exception):
+    pass
+
+
+_memory_queues = None  # pipe name -> asyncio.Queue, in single-process mode
+
+
+def use_memory_transport():
+    global _memory_queues
+    if _memory_queues is None:
+        _memory_queues = {}
+
+
+def ensure_fifo(pipe_name):
+    if not os.path.exists(pipe_name):
+        os.mkfifo(pipe_name)
+
+
+def encode_message(message):
+    if isinstance(message, MessageHistory):
+        envelope = {"type": "history", "data": message.to_dict()}
+    else:
+        envelope = {"type": "json", "data": message}
+    envelope["cid"] = correlation_id.get()
+    payload = json.dumps(envelope, separators=(",", ":")).encode("utf-8")
+    if len(payload) > MAX_FRAME_SIZE:
+        raise ValueError(f"frame too large: {len(payload)} bytes")
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+def decode_message(payload):
+    envelope = json.loads(payload)
+    # the receiving side logs under the sender's correlation id
+    correlation_id.set(envelope.get("cid"))
+    if envelope["type"] == "history":
+        return MessageHistory.from_dict(envelope["data"])
+    return envelope["data"]
+
+
+class PipeReader:
+    """Reads framed messages from a FIFO without blocking the event loop."""
+
+    def __init__(self, pipe_name):
+        self.pipe_name = pipe_name
+        self._reader = None
+        self._transport = None
+
+    async def open(self, discard_pending=False):
+        ensure_fifo(self.pipe_name)
+        # O_RDWR keeps a writer reference on our side, so opening never waits
+        # for the peer and a restarting peer does not cause EOF (Linux FIFOs).
+        fd = os.open(self.pipe_name, os.O_RDWR | os.O_NONBLOCK)
+        if discard_pending:
+            # the bytes in the pipe belong to a frame we lost track of
+            try:
+                while os.read(fd, 65536):
+                    pass
+            except BlockingIOError:
+                pass
+        loop = asyncio.get_running_loop()
+        self._reader = asyncio.StreamReader(limit=MAX_FRAME_SIZE, loop=loop)
+        protocol = asyncio.StreamReaderProtocol(self._reader, loop=loop)
+        self._transport, _ = await loop.connect_read_pipe(lambda: protocol, os.fdopen(fd, "rb", buffering=0))
+        return self
+
+    async def recv(self):
+        if self._reader is None:
+            await self.open()
+        header = await self._reader.readexactly(FRAME_HEADER.size)
+        # waiting for the header is idle time, the read stage starts after it
+        with metrics.time("ipc_read"):
+            (size,) = FRAME_HEADER.unpack(header)
+            if size > MAX_FRAME_SIZE:
+                # a corrupt header, every later read would start mid-frame
+                await self.resync()
+                raise ValueError(f"frame too large: {size} bytes")
+            payload = await self._reader.readexactly(size)
+            message = decode_message(payload)
+        metrics.count("ipc_frames_received")
+        return message
+
+    async def resync(self):
+        logger.warning("framing error, reopening pipe", extra={"pipe": self.pipe_name})
+        metrics.count("ipc_resyncs")
+        self.close()
+        await self.open(discard_pending=True)
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+            self._reader = None
+
+
+class PipeWriter:
+    """Writes framed messages to a FIFO through a bounded outbox.
+
+    send() only enqueues; a background task owns the FIFO and writes frames
+    back to back with non-blocking writes. The open, which waits until the
+    reader side exists, runs in a worker thread, so the event loop never
+    blocks on the pipe.
+    """
+
+    def __init__(self, pipe_name, max_pending=100, overflow=OVERFLOW_BLOCK):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"unknown overflow policy: {overflow}")
+        self.pipe_name = pipe_name
+        self.overflow = overflow
+        self.dropped = 0
+        self._outbox = self._make_outbox(max_pending)
+        self._fd = None
+        self._task = None
+
+    def _make_outbox(self, max_pending):
+        return asyncio.Queue(maxsize=max_pending)
+
+    def _encode(self, message):
+        return encode_message(message)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return self
+
+    @property
+    def pending(self):
+        return self._outbox.qsize()
+
+    async def send(self, message):
+        frame = self._encode(message)
+        if self._task is None:
+            self.start()
+        if self.overflow == OVERFLOW_BLOCK:
+            await self._outbox.put(frame)
+            return True
+        if self._outbox.full():
+            if self.overflow == OVERFLOW_ERROR:
+                raise OutboxFull(f"outbox of {self.pipe_name} is full")
+            self.dropped += 1
+            metrics.count("ipc_frames_dropped")
+            if self.overflow == OVERFLOW_DROP_NEWEST:
+                return False
+            self._outbox.get_nowait()
+            self._outbox.task_done()
+        self._outbox.put_nowait(frame)
+        return True
+
+    async def flush(self):
+        await self._outbox.join()
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    async def _run(self):
+        while True:
+            frame = await self._outbox.get()
+            try:
+                with metrics.time("ipc_write"):
+                    await self._write_frame(frame)
+                metrics.count("ipc_frames_sent")
+            except OSError as e:
+                logger.error("error writing to pipe", extra={"pipe": self.pipe_name, "error": str(e)})
+                await asyncio.sleep(1)
+            finally:
+                self._outbox.task_done()
+
+    def _open(self):
+        ensure_fifo(self.pipe_name)
+        fd = os.open(self.pipe_name, os.O_WRONLY)  # waits for a reader
+        os.set_blocking(fd, False)
+        return fd
+
+    async def _wait_writable(self):
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        loop.add_writer(self._fd, lambda: ready.done() or ready.set_result(None))
+        try:
+            await ready
+        finally:
+            loop.remove_writer(self._fd)
+
+    async def _write_frame(self, frame):
+        for attempt in range(2):
+            if self._fd is None:
+                self._fd = await asyncio.to_thread(self._open)
+            try:
+                view = memoryview(frame)
+                while view:
+                    try:
+                        written = os.write(self._fd, view)
+                    except BlockingIOError:
+                        await self._wait_writable()  # pipe buffer is full
+                        continue
+                    view = view[written:]
+                return
+            except BrokenPipeError:
+                # reader went away, reopen once and resend the whole frame
+                os.close(self._fd)
+                self._fd = None
+                if attempt:
+                    raise
+
+
+class MemoryReader:
+    """PipeReader interface over the in-memory queue of a pipe name."""
+
+    def __init__(self, pipe_name):
+        self.pipe_name = pipe_name
+
+    async def open(self):
+        return self
+
+    async def recv(self):
+        queue = _memory_queues.setdefault(self.pipe_name, asyncio.Queue())
+        message, cid = await queue.get()
+        queue.task_done()
+        correlation_id.set(cid)
+        metrics.count("ipc_frames_received")
+        return message
+
+    def close(self):
+        pass
+
+
+class MemoryWriter(PipeWriter):
+    """PipeWriter whose outbox is read directly by the MemoryReader.
+
+    Overflow policies work as for the FIFO, the reader drains the outbox.
+    Messages are passed by reference, the receiver must not modify them.
+    """
+
+    def _make_outbox(self, max_pending):
+        # the bots create their writers at import, before any reader exists
+        return _memory_queues.setdefault(self.pipe_name, asyncio.Queue(maxsize=max_pending))
+
+    def _encode(self, message):
+        return message, correlation_id.get()
+
+    def start(self):
+        return self
+
+    async def close(self):
+        pass
+
+
+async def open_reader(pipe_name):
+    if _memory_queues is not None:
+        return MemoryReader(pipe_name)
+    return await PipeReader(pipe_name).open()
+
+
+def writer_from_env(pipe_name):
+    writer_class = PipeWriter if _memory_queues is None else MemoryWriter
+    return writer_class(
+        pipe_name,
+        max_pending=int(os.getenv("IPC_OUTBOX_SIZE", "100")),
+        overflow=os.getenv("IPC_OVERFLOW_POLICY", OVERFLOW_BLOCK),
+    )
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+
+def normalize_text(text):
+    # whitespace differences do not change what the model is asked
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def agent_fingerprint(agent):
+    """The parts of an agent that change its answers, without the api keys."""
+    llm_config = agent.llm_config or {}
+    config_list = [
+        {key: value for key, value in config.items() if key != "api_key"}
+        for config in llm_config.get("config_list", [])
+    ]
+    return {"name": agent.name, "system_message": agent.system_message, "config_list": config_list}
+
+
+class LLMResultCache:
+    """On-disk cache of LLM stage results, keyed by a hash of everything that
+    goes into the call: agent configs, system messages, models and input.
+
+    Entries expire after ttl seconds; beyond max_entries the least recently
+    used ones are evicted. Safe to use from the llm pool threads.
+    """
+
+    def __init__(self, path="./tmp/llm_cache.sqlite", ttl=24 * 3600, max_entries=5000, bypass=False):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, used_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS llm_cache_used_at ON llm_cache (used_at)")
+        self._db.commit()
+
+    @staticmethod
+    def make_key(stage, agents, message):
+        parts = {
+            "stage": stage,
+            "agents": [agent_fingerprint(agent) for agent in agents],
+            "message": normalize_text(message),
+        }
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[1] > self.ttl:
+                self._db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._db.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE llm_cache SET used_at = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, created_at, used_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now),
+            )
+            self._db.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl,))
+            self._db.execute(
+                "DELETE FROM llm_cache WHERE key IN"
+                " (SELECT key FROM llm_cache ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._db.commit()
+
+    def get_or_compute(self, key, compute):
+        if self.bypass:
+            return compute()
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            # None reads back as a miss, an empty answer is computed again
+            if value is not None:
+                self.set(key, value)
+        return value
+
+    def stats(self):
+        with self._lock:
+            (entries,) = self._db.execute("SELECT COUNT(*) FROM llm_cache").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def cache_from_env():
+    return LLMResultCache(
+        path=os.getenv("LLM_CACHE_PATH", "./tmp/llm_cache.sqlite"),
+        ttl=float(os.getenv("LLM_CACHE_TTL", str(24 * 3600))),
+        max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000")),
+        bypass=os.getenv("LLM_CACHE_BYPASS", "0") == "1",
+    )
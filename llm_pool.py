@@ -0,0 +1,66 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import os
+
+
+class LLMJobTimeout(Exception):
+    pass
+
+
+class LLMExecutionPool:
+    """Runs blocking agent pipelines on a bounded worker pool.
+
+    The autogen chats are synchronous and take tens of seconds, so they must not
+    run on the discord event loop. run() hands the call to a thread pool and
+    awaits the result back on the loop. At most max_workers jobs run at
+    once, the rest wait for a slot.
+
+    A job that hits its timeout or whose awaiting task is cancelled is dropped:
+    if it has not started yet it never runs, if it is already running in a
+    thread its result is discarded (a thread can not be interrupted).
+    """
+
+    def __init__(self, max_workers=4, timeout=300):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm")
+        self._slots = asyncio.Semaphore(max_workers)
+        self.running = 0
+        self.waiting = 0
+
+    async def run(self, fn, *args, timeout=None, **kwargs):
+        timeout = self.timeout if timeout is None else timeout
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        try:
+            loop = asyncio.get_running_loop()
+            # logging in the job keeps the caller's correlation id
+            call = functools.partial(contextvars.copy_context().run, fn, *args, **kwargs)
+            future = loop.run_in_executor(self._executor, call)
+            try:
+                return await asyncio.wait_for(future, timeout)
+            except asyncio.TimeoutError:
+                raise LLMJobTimeout(f"{getattr(fn, '__name__', fn)} did not finish in {timeout}s")
+        finally:
+            self.running -= 1
+            self._slots.release()
+
+    def submit(self, fn, *args, timeout=None, **kwargs):
+        # returns a task, cancel it to drop the job
+        return asyncio.create_task(self.run(fn, *args, timeout=timeout, **kwargs))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def pool_from_env():
+    return LLMExecutionPool(
+        max_workers=int(os.getenv("LLM_POOL_WORKERS", "4")),
+        timeout=float(os.getenv("LLM_JOB_TIMEOUT", "300")),
+    )
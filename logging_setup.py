@@ -0,0 +1,136 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+
+# Bot logging goes through a queue: the event loop only enqueues the record,
+# a background thread formats it as one json line and writes it out. Every
+# record carries the correlation id of the Discord message being handled,
+# which travels with the history over the pipe to the private bot.
+
+correlation_id = contextvars.ContextVar("correlation_id", default=None)
+# the bot a record belongs to when both bots share one process (main.py
+# --single-process); unset, records carry the name given to setup_logging
+process_name = contextvars.ContextVar("process_name", default=None)
+_listener = None
+
+# attributes every LogRecord has, anything else was passed in extra=
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "correlation_id", "process_name"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "process": record.process_name,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if record.correlation_id is not None:
+            entry["correlation_id"] = record.correlation_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class RecordQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that queues records unformatted, exc_info included.
+
+    The stock prepare() formats the message on the thread that logs and
+    clears exc_info, so the writer thread never saw the exception.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class ContextFilter(logging.Filter):
+    def __init__(self, process_name):
+        super().__init__()
+        self.process_name = process_name
+
+    def filter(self, record):
+        record.correlation_id = correlation_id.get()
+        record.process_name = process_name.get() or self.process_name
+        return True
+
+
+class DebugSampler(logging.Filter):
+    """Samples and rate limits per-message debug output.
+
+    Records at DEBUG level pass with probability sample_rate and at most
+    max_per_second of them per logger. Higher levels always pass.
+    """
+
+    def __init__(self, sample_rate=0.1, max_per_second=5):
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.max_per_second = max_per_second
+        self._windows = {}  # logger name -> (second, count)
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return False
+        second = int(time.monotonic())
+        window, count = self._windows.get(record.name, (second, 0))
+        if window != second:
+            window, count = second, 0
+        if count >= self.max_per_second:
+            return False
+        self._windows[record.name] = (window, count + 1)
+        return True
+
+
+def setup_logging(process_name):
+    """Routes the process' logging through a queue to a json writer thread.
+
+    Handlers already on the root logger (main.py's log file) move behind the
+    queue with their own format. Only the first call configures logging, in
+    single-process mode the second bot shares the setup of the first and
+    main.py sets process_name for each bot.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+    level = os.getenv("LOG_LEVEL", "INFO").upper()
+    root = logging.getLogger()
+    handlers = list(root.handlers)
+    added = []
+    if not any(type(handler) is logging.StreamHandler for handler in handlers):
+        added.append(logging.StreamHandler(sys.stdout))
+    if os.getenv("LOG_FILE"):
+        added.append(logging.FileHandler(os.environ["LOG_FILE"]))
+    formatter = JsonFormatter()
+    for handler in added:
+        handler.setFormatter(formatter)
+    handlers += added
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = RecordQueueHandler(log_queue)
+    # filters run before the record is queued: sampling drops records early,
+    # and the correlation id is read in the context that logged the record
+    queue_handler.addFilter(DebugSampler(
+        sample_rate=float(os.getenv("LOG_DEBUG_SAMPLE", "0.1")),
+        max_per_second=int(os.getenv("LOG_DEBUG_MAX_PER_SECOND", "5")),
+    ))
+    queue_handler.addFilter(ContextFilter(process_name))
+
+    root.handlers[:] = [queue_handler]
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return _listener
@@ -5,13 +5,21 @@
 # OPENAI_API_KEY=your_openai_key_here
 # GUILD=your_guild_name_here
 # CHANNEL=your_channel_name_here
+#
+# python main.py                   two supervised bot processes talking over FIFOs
+# python main.py --single-process  both bots on one event loop, in-memory queues
 
-import subprocess
+import argparse
+import asyncio
+import collections
 import os
+import signal
+import stat
+import sys
 import time
-import pickle
 import logging
-from datetime import datetime
+
+import heartbeat
 
 # Set up logging
 logging.basicConfig(
@@ -26,56 +34,206 @@ logging.basicConfig(
 PIPE_FILE_PUBLIC_TO_PRIVATE = "message_public_to_private.pipe"
 PIPE_FILE_PRIVATE_TO_PUBLIC = "message_private_to_public.pipe"
 
-# Ensure a clean pipe file
-if os.path.exists(PIPE_FILE_PUBLIC_TO_PRIVATE):
-    os.remove(PIPE_FILE_PUBLIC_TO_PRIVATE)
-os.mkfifo(PIPE_FILE_PUBLIC_TO_PRIVATE)
+# guilds are sharded across this many private bot processes, each with its own
+# pair of pipes and data directories; see routing.py for pinning a guild to a
+# worker. Read from the environment of main.py: PRIVATE_WORKERS=2 python main.py
+PRIVATE_WORKERS = int(os.getenv("PRIVATE_WORKERS", "1"))
+
+
+def worker_pipes(worker):
+    # worker 0 keeps the original names
+    if worker == 0:
+        return PIPE_FILE_PUBLIC_TO_PRIVATE, PIPE_FILE_PRIVATE_TO_PUBLIC
+    return f"message_public_to_private.{worker}.pipe", f"message_private_to_public.{worker}.pipe"
 
-if os.path.exists(PIPE_FILE_PRIVATE_TO_PUBLIC):
-    os.remove(PIPE_FILE_PRIVATE_TO_PUBLIC)
-os.mkfifo(PIPE_FILE_PRIVATE_TO_PUBLIC)
+
+PIPE_FILES = [pipe for worker in range(PRIVATE_WORKERS) for pipe in worker_pipes(worker)]
 
 # Define bot configurations
 bot1_env = ".env_bot_rudy_server"
 bot2_env = ".env_bot_rudy_private"
 
-logging.info("Starting Discord bots...")
-
-# Start two Discord bot instances
-# read message from server and write to pipe
-bot1 = subprocess.Popen(["python", "bot_on_server.py",  bot1_env, PIPE_FILE_PUBLIC_TO_PRIVATE, PIPE_FILE_PRIVATE_TO_PUBLIC])
-# read message from pipe and process it
-bot2 = subprocess.Popen(["python", "bot_in_private.py",  bot2_env, PIPE_FILE_PUBLIC_TO_PRIVATE, PIPE_FILE_PRIVATE_TO_PUBLIC])
-
-logging.info(f"Main script is running, two bots started - PID1: {bot1.pid}, PID2: {bot2.pid}")
-
-# Keep the main script alive to monitor processes
-try:
-    while True:
-        time.sleep(60)  # Check every minute
-        
-        # Check if processes are still alive
-        if bot1.poll() is not None:
-            logging.error(f"Bot1 (server) has died with return code {bot1.returncode}")
-        if bot2.poll() is not None:
-            logging.error(f"Bot2 (private) has died with return code {bot2.returncode}")
-            
-        logging.info(f"Bots status check - Bot1 alive: {bot1.poll() is None}, Bot2 alive: {bot2.poll() is None}")
-        
-except KeyboardInterrupt:
-    logging.info("Received shutdown signal, terminating bots...")
-    bot1.terminate()
-    bot2.terminate()
-    
-    # Wait a bit for graceful shutdown
-    time.sleep(2)
-    
-    # Force kill if still running
-    if bot1.poll() is None:
-        bot1.kill()
-        logging.info("Force killed bot1")
-    if bot2.poll() is None:
-        bot2.kill()
-        logging.info("Force killed bot2")
-    
+HEARTBEAT_DIR = "./tmp/heartbeat"
+HEARTBEAT_TIMEOUT = float(os.getenv("HEARTBEAT_TIMEOUT", "60"))  # seconds without a beat before a restart
+STARTUP_GRACE = float(os.getenv("STARTUP_GRACE", "60"))  # time a new bot gets before its first beat
+BACKOFF_INITIAL = 1.0
+BACKOFF_MAX = 60.0
+STABLE_AFTER = 300.0  # a bot that ran this long resets its backoff
+CRASH_LOOP_RESTARTS = 5  # give up after this many restarts ...
+CRASH_LOOP_WINDOW = 600.0  # ... within this many seconds
+
+
+def reset_pipes():
+    # Ensure a clean pipe file, only while no bot has them open
+    for pipe_file in PIPE_FILES:
+        if os.path.exists(pipe_file):
+            os.remove(pipe_file)
+        os.mkfifo(pipe_file)
+
+
+def ensure_pipes():
+    # before a restart: the other bot may still have the fifo open, so a fifo
+    # is kept as is and only a missing or broken path is recreated
+    for pipe_file in PIPE_FILES:
+        if os.path.exists(pipe_file) and stat.S_ISFIFO(os.stat(pipe_file).st_mode):
+            continue
+        if os.path.lexists(pipe_file):
+            os.remove(pipe_file)
+        os.mkfifo(pipe_file)
+
+
+class SupervisedBot:
+    def __init__(self, name, script, env_file, pipe_public_to_private, pipe_private_to_public, env=None):
+        self.name = name
+        self.env = env or {}
+        self.args = [sys.executable, script, env_file, pipe_public_to_private, pipe_private_to_public]
+        self.heartbeat_file = os.path.join(HEARTBEAT_DIR, f"{name}.heartbeat")
+        self.process = None
+        self.started_at = None
+        self.restarts = collections.deque()
+        self.backoff = BACKOFF_INITIAL
+
+    async def start(self):
+        if os.path.exists(self.heartbeat_file):
+            os.remove(self.heartbeat_file)
+        env = dict(os.environ, **self.env, **{heartbeat.HEARTBEAT_FILE_ENV: self.heartbeat_file})
+        self.process = await asyncio.create_subprocess_exec(*self.args, env=env)
+        self.started_at = time.monotonic()
+        logging.info(f"{self.name} started - PID: {self.process.pid}")
+
+    def is_hung(self):
+        beat_age = heartbeat.age(self.heartbeat_file)
+        if beat_age is None:
+            return time.monotonic() - self.started_at > STARTUP_GRACE
+        return beat_age > HEARTBEAT_TIMEOUT
+
+    async def watch_heartbeat(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_TIMEOUT / 4)
+            if self.is_hung():
+                return
+
+    async def stop(self, timeout=5.0):
+        if self.process is None or self.process.returncode is not None:
+            return
+        self.process.terminate()
+        try:
+            await asyncio.wait_for(self.process.wait(), timeout)
+        except asyncio.TimeoutError:
+            self.process.kill()
+            await self.process.wait()
+            logging.info(f"Force killed {self.name}")
+
+    def next_backoff(self):
+        now = time.monotonic()
+        if now - self.started_at > STABLE_AFTER:
+            self.backoff = BACKOFF_INITIAL
+        delay = self.backoff
+        self.backoff = min(self.backoff * 2, BACKOFF_MAX)
+        self.restarts.append(now)
+        while self.restarts and now - self.restarts[0] > CRASH_LOOP_WINDOW:
+            self.restarts.popleft()
+        return delay
+
+    def is_crash_looping(self):
+        return len(self.restarts) > CRASH_LOOP_RESTARTS
+
+
+async def supervise(bot, stopping):
+    while not stopping.is_set():
+        await bot.start()
+        exited = asyncio.create_task(bot.process.wait())
+        hung = asyncio.create_task(bot.watch_heartbeat())
+        stop = asyncio.create_task(stopping.wait())
+        await asyncio.wait([exited, hung, stop], return_when=asyncio.FIRST_COMPLETED)
+        for task in (exited, hung, stop):
+            task.cancel()
+        if stopping.is_set():
+            return
+        if bot.process.returncode is None:
+            logging.error(f"{bot.name} missed its heartbeat for {HEARTBEAT_TIMEOUT}s, restarting")
+            await bot.stop()
+        else:
+            logging.error(f"{bot.name} has died with return code {bot.process.returncode}")
+
+        delay = bot.next_backoff()
+        if bot.is_crash_looping():
+            logging.error(f"{bot.name} restarted {len(bot.restarts)} times in {CRASH_LOOP_WINDOW:.0f}s, giving up")
+            stopping.set()
+            return
+        logging.info(f"Restarting {bot.name} in {delay:.0f}s")
+        try:
+            await asyncio.wait_for(stopping.wait(), delay)
+            return
+        except asyncio.TimeoutError:
+            pass
+        ensure_pipes()
+
+
+async def main():
+    reset_pipes()
+    os.makedirs(HEARTBEAT_DIR, exist_ok=True)
+
+    logging.info("Starting Discord bots...")
+    pipes = [worker_pipes(worker) for worker in range(PRIVATE_WORKERS)]
+    bots = [
+        # read message from server and write to the pipe of the guild's worker
+        SupervisedBot("bot_on_server", "bot_on_server.py", bot1_env,
+                      ",".join(pipe for pipe, _ in pipes), ",".join(pipe for _, pipe in pipes)),
+    ]
+    for worker, (pipe_public_to_private, pipe_private_to_public) in enumerate(pipes):
+        # read message from pipe and process it
+        name = "bot_in_private" if worker == 0 else f"bot_in_private.{worker}"
+        bots.append(SupervisedBot(name, "bot_in_private.py", bot2_env, pipe_public_to_private, pipe_private_to_public,
+                                  env={"PRIVATE_WORKER": str(worker), "METRICS_PORT_OFFSET": str(worker)}))
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+
+    await asyncio.gather(*(supervise(bot, stopping) for bot in bots))
+
+    logging.info("Shutting down, terminating bots...")
+    await asyncio.gather(*(bot.stop() for bot in bots))
     logging.info("All bots terminated")
+    if any(bot.is_crash_looping() for bot in bots):
+        sys.exit(1)
+
+
+async def run_as(name, coro):
+    # the tasks the bot starts inherit the name, so their records carry it
+    from logging_setup import process_name
+
+    process_name.set(name)
+    return await coro
+
+
+async def run_single_process():
+    # both bots share this process: one autogen import, no pipe round trips.
+    # Each bot reads its env file at import, the private bot's is loaded last,
+    # so settings read later (metrics) come from it; logging is set up by the
+    # server bot's import.
+    import ipc
+    from logging_setup import process_name
+
+    process_name.set("main")
+    ipc.use_memory_transport()
+    sys.argv = [sys.argv[0], bot1_env, PIPE_FILE_PUBLIC_TO_PRIVATE, PIPE_FILE_PRIVATE_TO_PUBLIC]
+    import bot_on_server
+    sys.argv[1] = bot2_env
+    import bot_in_private
+
+    logging.info("Starting Discord bots in a single process...")
+    await asyncio.gather(run_as("bot_on_server", bot_on_server.main()), run_as("bot_in_private", bot_in_private.main()))
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--single-process", action="store_true",
+                    help="run both bots on one event loop, connected by in-memory queues")
+args = parser.parse_args()
+
+if args.single_process:
+    asyncio.run(run_single_process())
+else:
+    asyncio.run(main())
@@ -0,0 +1,215 @@
+import asyncio
+import os
+import sqlite3
+import threading
+
+from archive import timestamp_to_micros
+from data_definition import MessageRecord
+from metrics import metrics
+
+# Local copy of the watched channels, fed by the gateway events the server bot
+# gets anyway. Reads are indexed SQLite queries instead of channel.history()
+# REST calls; on startup each channel is backfilled from its newest stored
+# message (utils.backfill_channel), after that the gateway keeps it current.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    channel_id INTEGER NOT NULL,
+    guild_id INTEGER,
+    guild_channel TEXT,
+    author TEXT,
+    content TEXT,
+    timestamp TEXT,
+    created_us INTEGER,
+    is_reply INTEGER,
+    author_is_bot INTEGER,
+    reply_to INTEGER,
+    thread_root INTEGER
+);
+CREATE INDEX IF NOT EXISTS messages_channel_created ON messages (channel_id, created_us);
+CREATE INDEX IF NOT EXISTS messages_author ON messages (author);
+CREATE INDEX IF NOT EXISTS messages_thread_root ON messages (thread_root);
+"""
+
+COLUMNS = "id, author, content, timestamp, guild_id, channel_id, guild_channel, is_reply, author_is_bot, reply_to, thread_root"
+
+# a reply's thread root is its parent's root, or the parent itself until the
+# parent is stored
+UPSERT = """
+INSERT INTO messages (id, channel_id, guild_id, guild_channel, author, content, timestamp, created_us,
+                      is_reply, author_is_bot, reply_to, thread_root)
+VALUES (:id, :channel_id, :guild_id, :guild_channel, :author, :content, :timestamp, :created_us,
+        :is_reply, :author_is_bot, :reply_to,
+        COALESCE((SELECT thread_root FROM messages WHERE id = :reply_to), :reply_to, :id))
+ON CONFLICT (id) DO UPDATE SET content = excluded.content
+"""
+
+# replies stored before their parent have the parent as root, move them to
+# the root the parent got
+FIX_THREAD_ROOTS = """
+UPDATE messages SET thread_root = (SELECT thread_root FROM messages WHERE id = :id)
+WHERE thread_root = :id
+"""
+
+def _row_to_record(row):
+    id, author, content, timestamp, guild_id, channel_id, guild_channel, is_reply, author_is_bot, reply_to, thread_root = row
+    return MessageRecord(id, author, content, timestamp, guild_id, channel_id, guild_channel,
+                         bool(is_reply), bool(author_is_bot), reply_to, thread_root)
+
+
+class MessageStore:
+    """SQLite (WAL) store of gateway messages with batched writes.
+
+    ingest(), edit() and delete() only queue the change; a writer task applies
+    the queue in one transaction every flush_interval seconds, or as soon as
+    batch_size changes are waiting. Queries flush first, so they see every
+    event received so far, and run in a worker thread on their own
+    connection, which WAL lets read while the writer writes.
+    """
+
+    def __init__(self, path="./tmp/messages.sqlite", batch_size=200, flush_interval=0.5):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._write_db = self._connect()
+        self._write_db.executescript(SCHEMA)
+        self._read_db = self._connect()
+        self._write_lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._pending = []
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        # channel id -> newest messages backfilled in this process, after that
+        # the gateway keeps the channel current
+        self.synced_channels = {}
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return self
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def _queue(self, op):
+        self._pending.append(op)
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    def ingest(self, record):
+        self._queue(("upsert", {
+            "id": record.id,
+            "channel_id": record.channel_id,
+            "guild_id": record.guild_id,
+            "guild_channel": record.guild_channel,
+            "author": record.author,
+            "content": record.content,
+            "timestamp": record.timestamp,
+            "created_us": timestamp_to_micros(record.timestamp),
+            "is_reply": record.is_reply,
+            "author_is_bot": record.author_is_bot,
+            "reply_to": record.reply_to_message_id,
+        }))
+
+    def edit(self, message_id, content):
+        if content is not None:
+            self._queue(("edit", (content, message_id)))
+
+    def delete(self, message_id):
+        self._queue(("delete", (message_id,)))
+
+    def _apply(self, ops):
+        with self._write_lock, self._write_db:  # one transaction
+            for kind, params in ops:
+                if kind == "upsert":
+                    self._write_db.execute(UPSERT, params)
+                    if params["reply_to"] is not None:
+                        self._write_db.execute(FIX_THREAD_ROOTS, params)
+                elif kind == "edit":
+                    self._write_db.execute("UPDATE messages SET content = ? WHERE id = ?", params)
+                else:
+                    self._write_db.execute("DELETE FROM messages WHERE id = ?", params)
+
+    async def flush(self):
+        async with self._flush_lock:
+            while self._pending:
+                ops, self._pending = self._pending[:self.batch_size], self._pending[self.batch_size:]
+                with metrics.time("store_write"):
+                    await asyncio.to_thread(self._apply, ops)
+                metrics.count("store_writes", len(ops))
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+        self._write_db.close()
+        self._read_db.close()
+
+    def _query(self, sql, params):
+        with self._read_lock:
+            return [_row_to_record(row) for row in self._read_db.execute(sql, params)]
+
+    async def _select(self, sql, params=()):
+        await self.flush()
+        with metrics.time("store_read"):
+            return await asyncio.to_thread(self._query, sql, params)
+
+    async def latest(self, channel_id, limit=5):
+        """The newest messages of the channel, newest first, like channel.history()."""
+        return await self._select(
+            f"SELECT {COLUMNS} FROM messages WHERE channel_id = ? ORDER BY created_us DESC, id DESC LIMIT ?",
+            (channel_id, limit))
+
+    async def between(self, channel_id, start, end):
+        """Messages of the channel from start to end (datetimes), oldest first."""
+        return await self._select(
+            f"SELECT {COLUMNS} FROM messages WHERE channel_id = ? AND created_us >= ? AND created_us < ? ORDER BY created_us",
+            (channel_id, timestamp_to_micros(str(start)), timestamp_to_micros(str(end))))
+
+    async def by_author(self, author, limit=100):
+        return await self._select(
+            f"SELECT {COLUMNS} FROM messages WHERE author = ? ORDER BY id DESC LIMIT ?", (author, limit))
+
+    async def thread(self, root_id):
+        """The root and every reply under it, oldest first."""
+        return await self._select(
+            f"SELECT {COLUMNS} FROM messages WHERE thread_root = ? ORDER BY id", (root_id,))
+
+    async def newest_id(self, channel_id):
+        await self.flush()
+
+        def query():
+            with self._read_lock:
+                return self._read_db.execute("SELECT MAX(id) FROM messages WHERE channel_id = ?", (channel_id,)).fetchone()[0]
+        return await asyncio.to_thread(query)
+
+
+def store_from_env():
+    """The MessageStore when MESSAGE_STORE_ENABLED=1, otherwise None (REST only)."""
+    if os.getenv("MESSAGE_STORE_ENABLED", "0") != "1":
+        return None
+    return MessageStore(
+        path=os.getenv("MESSAGE_STORE_PATH", "./tmp/messages.sqlite"),
+        batch_size=int(os.getenv("MESSAGE_STORE_BATCH_SIZE", "200")),
+        flush_interval=float(os.getenv("MESSAGE_STORE_FLUSH_SECONDS", "0.5")),
+    )
@@ -0,0 +1,213 @@
+import asyncio
+import contextlib
+import contextvars
+import logging
+import os
+import time
+
+# Per-stage latency histograms, event counters and queue depth gauges of one
+# bot process. Exposed as Prometheus text on http://127.0.0.1:<port>/metrics
+# and as a periodic summary line. When disabled every call returns right away.
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_NOOP = contextlib.nullcontext()
+
+logger = logging.getLogger(__name__)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = 0
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            index = len(self.buckets)
+        self.counts[index] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q):
+        # upper bound of the bucket the quantile falls in
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.buckets[index] if index < len(self.buckets) else float("inf")
+        return float("inf")
+
+
+class _Timer:
+    __slots__ = ("metrics", "stage", "start")
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.stage, time.perf_counter() - self.start)
+
+
+class Metrics:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.stages = {}  # stage -> Histogram
+        self.counters = {}  # event -> count
+        self.gauges = {}  # queue -> callable returning the current depth
+        self.server = None
+
+    def observe(self, stage, seconds):
+        if not self.enabled:
+            return
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = Histogram()
+        histogram.observe(seconds)
+
+    def time(self, stage):
+        """with metrics.time("history_fetch"): ..."""
+        if not self.enabled:
+            return _NOOP
+        return _Timer(self, stage)
+
+    def count(self, event, n=1):
+        if not self.enabled:
+            return
+        self.counters[event] = self.counters.get(event, 0) + n
+
+    def gauge(self, queue, read_depth):
+        self.gauges[queue] = read_depth
+
+    def render(self):
+        lines = [
+            "# HELP bot_stage_seconds Latency of each pipeline stage.",
+            "# TYPE bot_stage_seconds histogram",
+        ]
+        for stage, histogram in sorted(self.stages.items()):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'bot_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'bot_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+            lines.append(f'bot_stage_seconds_sum{{stage="{stage}"}} {histogram.total}')
+            lines.append(f'bot_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+        lines += ["# HELP bot_events_total Events seen by the bot.", "# TYPE bot_events_total counter"]
+        for event, count in sorted(self.counters.items()):
+            lines.append(f'bot_events_total{{event="{event}"}} {count}')
+        lines += ["# HELP bot_queue_depth Items waiting in each queue.", "# TYPE bot_queue_depth gauge"]
+        for queue, read_depth in sorted(self.gauges.items()):
+            lines.append(f'bot_queue_depth{{queue="{queue}"}} {read_depth()}')
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        parts = []
+        for stage, histogram in sorted(self.stages.items()):
+            parts.append(f"{stage} n={histogram.count} p50<={histogram.quantile(0.5)}s p99<={histogram.quantile(0.99)}s")
+        parts += [f"{queue}={read_depth()}" for queue, read_depth in sorted(self.gauges.items())]
+        parts += [f"{event}={count}" for event, count in sorted(self.counters.items())]
+        return "metrics: " + ", ".join(parts)
+
+    async def _handle_http(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass  # skip the headers
+            path = request_line.split(b" ")[1] if request_line.count(b" ") >= 2 else b""
+            if path == b"/metrics":
+                status, body = "200 OK", self.render().encode()
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, port, host="127.0.0.1"):
+        self.server = await asyncio.start_server(self._handle_http, host, port)
+        return self.server
+
+    async def log_summary_forever(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            logger.info(self.summary())
+
+
+class LLMCallCounter:
+    __slots__ = ("calls",)
+
+    def __init__(self):
+        self.calls = 0
+
+
+_llm_call_counter = contextvars.ContextVar("llm_call_counter", default=None)
+
+
+def count_llm_calls():
+    """Counts the LLM calls made from here on in this context, e.g. per event.
+
+    The llm pool runs jobs in a copy of the caller's context, so calls made
+    by its worker threads are counted too.
+    """
+    counter = LLMCallCounter()
+    _llm_call_counter.set(counter)
+    return counter
+
+
+def instrument_agent(agent):
+    # times every LLM round trip of the agent as stage llm_call:<agent name>,
+    # and counts it for count_llm_calls() even when metrics are disabled
+    client = getattr(agent, "client", None)
+    if client is None:
+        return agent
+    create = client.create
+    stage = f"llm_call:{agent.name}"
+
+    def timed_create(*args, **kwargs):
+        metrics.count("llm_calls")
+        counter = _llm_call_counter.get()
+        if counter is not None:
+            counter.calls += 1
+        with metrics.time(stage):
+            return create(*args, **kwargs)
+
+    client.create = timed_create
+    return agent
+
+
+metrics = Metrics()
+
+
+async def start_from_env():
+    """Enables metrics if METRICS_ENABLED=1 and starts the endpoint and the summary log.
+
+    In single-process mode the second bot finds them running and shares them.
+    """
+    if metrics.server is not None:
+        return
+    metrics.enabled = os.getenv("METRICS_ENABLED", "0") == "1"
+    if not metrics.enabled:
+        return
+    # private workers after the first serve on the following ports
+    port = int(os.getenv("METRICS_PORT", "9101")) + int(os.getenv("METRICS_PORT_OFFSET", "0"))
+    await metrics.serve(port)
+    logger.info(f"metrics on http://127.0.0.1:{port}/metrics")
+    interval = float(os.getenv("METRICS_LOG_INTERVAL", "60"))
+    if interval > 0:
+        asyncio.create_task(metrics.log_summary_forever(interval))
@@ -0,0 +1,65 @@
+import asyncio
+import contextlib
+import time
+
+from send_scheduler import MAX_MESSAGE_LENGTH, split_message
+
+
+class ProgressMessage:
+    """A follow-up message that is edited as partial results come in.
+
+    update() only records the latest text and can be called from any thread
+    through the loop (call_soon_threadsafe). A single editor task sends at most
+    one edit every min_interval seconds, always with the latest text, so a
+    burst of updates costs one edit. finish() makes the last edit and posts
+    whatever does not fit into one message as further follow-ups; updates
+    arriving after it are ignored.
+    """
+
+    def __init__(self, interaction, min_interval=1.5):
+        self.interaction = interaction
+        self.min_interval = min_interval
+        self.message = None
+        self._text = None
+        self._shown = None
+        self._last_edit = 0.0
+        self._editor = None
+        self._finished = False
+
+    async def start(self, text):
+        self.message = await self.interaction.followup.send(text, wait=True)
+        self._shown = text
+        self._last_edit = time.monotonic()
+        return self
+
+    def update(self, text):
+        if self._finished:
+            return
+        self._text = text[:MAX_MESSAGE_LENGTH]
+        if self._editor is None or self._editor.done():
+            self._editor = asyncio.create_task(self._edit_latest())
+
+    async def _edit_latest(self):
+        while not self._finished and self._text != self._shown:
+            delay = self._last_edit + self.min_interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                if self._finished:
+                    return
+            text = self._text
+            await self.message.edit(content=text)
+            self._shown = text
+            self._last_edit = time.monotonic()
+
+    async def finish(self, text):
+        self._finished = True
+        if self._editor is not None:
+            # an edit in flight must not land after the final one
+            self._editor.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._editor
+        first, *rest = split_message(text)
+        await self.message.edit(content=first)
+        self._text = self._shown = first
+        for chunk in rest:
+            await self.interaction.followup.send(chunk)
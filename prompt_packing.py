@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import os
+from datetime import datetime
+
+from thread_index import group_by_thread
+
+logger = logging.getLogger(__name__)
+
+
+_token_counters = {}  # model -> counter, loaded once per process
+
+
+def approximate_tokens(text):
+    return len(text) // 4 + 1
+
+
+def load_token_counter(model="gpt-4"):
+    """Counts tokens with the model's tiktoken encoding.
+
+    tiktoken comes with ag2[openai], but downloads the encoding the first
+    time; when it is missing or the download fails, ~4 characters per token
+    is close enough for budgeting, and loading is not tried again.
+    """
+    counter = _token_counters.get(model)
+    if counter is not None:
+        return counter
+    try:
+        import tiktoken
+        encoding = tiktoken.encoding_for_model(model)
+    except Exception as e:
+        logger.warning("tokenizer not available, approximating token counts", extra={"model": model, "error": repr(e)})
+        counter = approximate_tokens
+    else:
+        counter = lambda text: len(encoding.encode(text, disallowed_special=()))
+    _token_counters[model] = counter
+    return counter
+
+
+def relative_time(timestamp, reference):
+    seconds = int((reference - datetime.fromisoformat(timestamp)).total_seconds())
+    if seconds < 1:
+        return "now"
+    for unit, size in (("d", 86400), ("h", 3600), ("m", 60)):
+        if seconds >= size:
+            return f"-{seconds // size}{unit}"
+    return f"-{seconds}s"
+
+
+class PackResult:
+    def __init__(self, text, tokens_used, tokens_dropped, messages_used, messages_dropped, ids=()):
+        self.text = text
+        self.ids = set(ids)  # ids of the messages in text
+        self.tokens_used = tokens_used
+        self.tokens_dropped = tokens_dropped
+        self.messages_used = messages_used
+        self.messages_dropped = messages_dropped
+
+    def __repr__(self):
+        return (f"PackResult(tokens_used={self.tokens_used}, tokens_dropped={self.tokens_dropped}, "
+                f"messages_used={self.messages_used}, messages_dropped={self.messages_dropped})")
+
+
+class HistoryPacker:
+    """Packs channel history into a prompt of at most token_budget tokens.
+
+    The triggering message goes in first, then the rest of its thread, then the
+    other messages newest first, until the budget is used up. Lines are compact:
+    authors get short tags (A1, A2, ...) listed once in a legend, timestamps are
+    relative to the trigger, and threads are kept together, oldest first.
+    """
+
+    def __init__(self, token_budget=3000, count_tokens=None, model="gpt-4"):
+        self.token_budget = token_budget
+        self.model = model
+        self._count_tokens = count_tokens
+
+    def count_tokens(self, text):
+        # the tokenizer is loaded on first use, not at import
+        if self._count_tokens is None:
+            self._count_tokens = load_token_counter(self.model)
+        return self._count_tokens(text)
+
+    async def warm_up(self):
+        # tiktoken may download its encoding the first time, keep that off the
+        # event loop: the bots await this before they connect
+        await asyncio.to_thread(self.count_tokens, "")
+
+    def pack(self, msg_list, trigger=None):
+        if not msg_list:
+            return PackResult("", 0, 0, 0, 0)
+        if trigger is None:
+            trigger = max(msg_list, key=lambda msg: msg.id)
+        reference = datetime.fromisoformat(trigger.timestamp)
+
+        thread = [msg for msg in msg_list if msg.original_thread_id == trigger.original_thread_id and msg is not trigger]
+        others = [msg for msg in msg_list if msg.original_thread_id != trigger.original_thread_id]
+        candidates = [trigger] + sorted(thread, key=lambda msg: msg.id, reverse=True) + sorted(others, key=lambda msg: msg.id, reverse=True)
+
+        author_tags = {}
+        lines = {}  # message id -> line
+        tokens_used = self.count_tokens("authors:\n")
+        tokens_dropped = 0
+        for msg in candidates:
+            new_author = msg.author not in author_tags
+            tag = author_tags.get(msg.author) or f"A{len(author_tags) + 1}"
+            line = f"{relative_time(msg.timestamp, reference)} {tag}: {msg.content}"
+            tokens = self.count_tokens(line) + 1
+            if new_author:
+                tokens += self.count_tokens(f" {tag}={msg.author}")
+            if tokens_used + tokens > self.token_budget:
+                tokens_dropped += tokens
+                continue
+            tokens_used += tokens
+            lines[msg.id] = line
+            if new_author:
+                author_tags[msg.author] = tag
+
+        legend = "authors: " + " ".join(f"{tag}={author}" for author, tag in author_tags.items())
+        blocks = [legend]
+        kept = [msg for msg in msg_list if msg.id in lines]
+        for thread_msgs in group_by_thread(kept).values():
+            blocks.append("\n".join(lines[msg.id] for msg in thread_msgs))
+        return PackResult("\n\n".join(blocks), tokens_used, tokens_dropped, len(lines), len(msg_list) - len(lines), lines)
+
+
+def packer_from_env():
+    return HistoryPacker(
+        token_budget=int(os.getenv("PROMPT_TOKEN_BUDGET", "3000")),
+        model=os.getenv("PROMPT_TOKENIZER_MODEL", "gpt-4"),
+    )
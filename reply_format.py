@@ -0,0 +1,18 @@
+from typing import Annotated
+
+from pydantic import BaseModel
+
+
+class ReplyFormat(BaseModel):
+    need_human_reply_score: Annotated[int, "Must be between 1 and 10"]
+    reason: str
+    response: str
+
+
+class Topic(BaseModel):
+    topic: str
+    messages: list[str]
+
+
+class TopicSplit(BaseModel):
+    topics: list[Topic]
@@ -0,0 +1,254 @@
+import asyncio
+import heapq
+import logging
+import os
+import threading
+
+from agent_registry import resolve
+from data_definition import MessageRecord
+from embeddings import HashingEmbedder, cosine
+from metrics import metrics
+
+try:
+    import numpy as np  # comes with ag2 and chromadb
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Semantic recall over everything the private bot has seen of a channel. The
+# history that comes over the pipe is only the last few messages; for the
+# message that triggered it, the retriever finds the most similar earlier
+# messages of the same channel and the threads they belong to, so the prompt
+# gets the earlier discussion of the same topic.
+
+
+class SentenceTransformerEmbedder:
+    """A local sentence-transformers model, the one the teachability db uses by default."""
+
+    def __init__(self, model="all-MiniLM-L6-v2"):
+        self.model_name = model
+        self._model = None
+
+    def embed(self, texts):
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+            self._model = SentenceTransformer(self.model_name)
+        return self._model.encode(list(texts), normalize_embeddings=True).tolist()
+
+
+def embedder_from_spec(spec):
+    """ "hashing", "hashing:<dim>", "sentence-transformers:<model>" or "module:factory"."""
+    name, _, argument = spec.partition(":")
+    if name == "hashing":
+        return HashingEmbedder(int(argument or 512))
+    if name == "sentence-transformers":
+        return SentenceTransformerEmbedder(argument or "all-MiniLM-L6-v2")
+    return resolve(spec)()
+
+
+class InProcessIndex:
+    """Exact cosine search, one matrix per channel, kept in memory.
+
+    A channel keeps its newest max_per_channel vectors, 4 bytes per dimension
+    each: 10000 hashing vectors of 512 dimensions are 20 MB.
+    """
+
+    def __init__(self, max_per_channel=10000):
+        self.max_per_channel = max_per_channel
+        self._channels = {}  # channel id -> (ids, vectors)
+        self._lock = threading.Lock()
+
+    def add(self, records, vectors):
+        with self._lock:
+            by_channel = {}
+            for record, vector in zip(records, vectors):
+                by_channel.setdefault(record.channel_id, ([], []))
+                by_channel[record.channel_id][0].append(record.id)
+                by_channel[record.channel_id][1].append(vector)
+            for channel_id, (ids, new_vectors) in by_channel.items():
+                old_ids, old_vectors = self._channels.get(channel_id, ([], None))
+                ids = (old_ids + ids)[-self.max_per_channel:]
+                if np is not None:
+                    new_vectors = np.asarray(new_vectors, dtype=np.float32)
+                    vectors = new_vectors if old_vectors is None else np.vstack([old_vectors, new_vectors])
+                else:
+                    vectors = (old_vectors or []) + new_vectors
+                self._channels[channel_id] = (ids, vectors[-self.max_per_channel:])
+
+    def query(self, channel_id, vector, k):
+        """[(message id, similarity)], best first."""
+        with self._lock:
+            ids, vectors = self._channels.get(channel_id, ([], None))
+        if not ids:
+            return []
+        if np is not None:
+            scores = vectors @ np.asarray(vector, dtype=np.float32)
+            top = np.argsort(-scores)[:k]
+            return [(ids[i], float(scores[i])) for i in top]
+        return heapq.nlargest(k, ((id, cosine(vector, v)) for id, v in zip(ids, vectors)), key=lambda hit: hit[1])
+
+    def __len__(self):
+        return sum(len(ids) for ids, _ in self._channels.values())
+
+
+class ChromaIndex:
+    """The same interface on a persistent chromadb collection, kept across restarts."""
+
+    def __init__(self, path="./tmp/retrieval_db", collection="channel_history"):
+        import chromadb
+
+        self._client = chromadb.PersistentClient(path=path)
+        # embeddings are always passed in, chroma never embeds itself
+        self._collection = self._client.get_or_create_collection(collection, metadata={"hnsw:space": "cosine"})
+
+    def add(self, records, vectors):
+        self._collection.upsert(
+            ids=[str(record.id) for record in records],
+            embeddings=[list(vector) for vector in vectors],
+            documents=[record.content for record in records],
+            metadatas=[{
+                "channel_id": record.channel_id,
+                "guild_id": record.guild_id,
+                "guild_channel": record.guild_channel,
+                "author": record.author,
+                "timestamp": record.timestamp,
+                # chroma rejects None values, 0 stands for no thread
+                "thread_root": record.original_thread_id or 0,
+            } for record in records],
+        )
+
+    def records(self, ids):
+        # hits indexed before a restart are not in the retriever's memory
+        result = self._collection.get(ids=[str(id) for id in ids])
+        return [
+            MessageRecord(int(id), meta["author"], document, meta["timestamp"], meta["guild_id"], meta["channel_id"],
+                          meta["guild_channel"], original_thread_id=meta.get("thread_root") or None)
+            for id, document, meta in zip(result["ids"], result["documents"], result["metadatas"])
+        ]
+
+    def query(self, channel_id, vector, k):
+        # chroma fails when asked for more results than the collection has
+        k = min(k, self._collection.count())
+        if k == 0:
+            return []
+        result = self._collection.query(query_embeddings=[list(vector)], n_results=k, where={"channel_id": channel_id})
+        return [(int(id), 1.0 - distance) for id, distance in zip(result["ids"][0], result["distances"][0])]
+
+    def __len__(self):
+        return self._collection.count()
+
+
+class HistoryRetriever:
+    """Indexes the messages of incoming histories and finds related earlier ones.
+
+    ingest() only queues messages it has not seen, embedding happens in
+    batches of batch_size in a worker thread, by the background flush loop
+    or right before a query. related() returns the top-k hits of the
+    trigger's channel scoring at least min_score and the rest of their
+    threads, oldest first.
+    """
+
+    def __init__(self, index, embedder, batch_size=64, max_records=200000, min_score=0.0):
+        self.index = index
+        self.embedder = embedder
+        self.batch_size = batch_size
+        self.max_records = max_records
+        self.min_score = min_score
+        self.records = {}  # message id -> MessageRecord, insertion ordered
+        self.threads = {}  # thread root id -> [message id]
+        self._pending = []
+        self._flush_lock = asyncio.Lock()
+
+    def ingest(self, msg_list):
+        for msg in msg_list:
+            if msg.id in self.records or not msg.content:
+                continue
+            self.records[msg.id] = msg
+            self.threads.setdefault(msg.original_thread_id, []).append(msg.id)
+            self._pending.append(msg)
+        while len(self.records) > self.max_records:
+            self._forget(self.records.pop(next(iter(self.records))))
+
+    def _forget(self, msg):
+        thread = self.threads.get(msg.original_thread_id)
+        if thread is None:
+            return
+        if msg.id in thread:
+            thread.remove(msg.id)
+        if not thread:
+            del self.threads[msg.original_thread_id]
+
+    async def flush(self):
+        async with self._flush_lock:
+            while self._pending:
+                batch, self._pending = self._pending[:self.batch_size], self._pending[self.batch_size:]
+                try:
+                    with metrics.time("retrieval_embed"):
+                        vectors = await asyncio.to_thread(self.embedder.embed, [msg.content for msg in batch])
+                    await asyncio.to_thread(self.index.add, batch, vectors)
+                except Exception:
+                    # the batch is not retried, a bad batch would fail forever
+                    logger.exception("indexing failed", extra={"messages": len(batch)})
+                    metrics.count("retrieval_index_errors")
+                    continue
+                metrics.count("retrieval_indexed", len(batch))
+
+    async def flush_forever(self, interval=2.0):
+        while True:
+            await asyncio.sleep(interval)
+            if self._pending:
+                await self.flush()
+
+    async def related(self, trigger, k=5, exclude_ids=()):
+        await self.flush()
+        with metrics.time("retrieval_query"):
+            (vector,) = await asyncio.to_thread(self.embedder.embed, [trigger.content])
+            # ask for more, the trigger and the excluded messages are among the hits
+            hits = await asyncio.to_thread(self.index.query, trigger.channel_id, vector, k + len(exclude_ids) + 1)
+        # hits below min_score are too far off topic to help the prompt
+        hits = [(id, score) for id, score in hits if score >= self.min_score]
+        exclude = set(exclude_ids) | {trigger.id}
+        missing = [id for id, _ in hits if id not in self.records and id not in exclude]
+        if missing and hasattr(self.index, "records"):
+            for msg in await asyncio.to_thread(self.index.records, missing):
+                self.records[msg.id] = msg
+                self.threads.setdefault(msg.original_thread_id, []).append(msg.id)
+        related = {}
+        for id, _ in hits:
+            if id in exclude or id not in self.records:
+                continue
+            for thread_id in self.threads.get(self.records[id].original_thread_id, [id]):
+                if thread_id not in exclude and thread_id in self.records:
+                    related[thread_id] = self.records[thread_id]
+            k -= 1
+            if k == 0:
+                break
+        return sorted(related.values(), key=lambda msg: msg.id)
+
+    def backfill(self, path):
+        """Ingests an archive written by history_download_main.py."""
+        from archive import ArchiveReader
+
+        with ArchiveReader(path) as reader:
+            self.ingest(list(reader))
+
+
+def retriever_from_env():
+    """The configured HistoryRetriever, or None when RETRIEVAL_ENABLED is not 1."""
+    if os.getenv("RETRIEVAL_ENABLED", "0") != "1":
+        return None
+    embedder = embedder_from_spec(os.getenv("RETRIEVAL_EMBEDDER", "hashing"))
+    if os.getenv("RETRIEVAL_INDEX", "memory") == "chroma":
+        index = ChromaIndex(os.getenv("RETRIEVAL_DB_DIR", "./tmp/retrieval_db"))
+    else:
+        index = InProcessIndex(max_per_channel=int(os.getenv("RETRIEVAL_MAX_PER_CHANNEL", "10000")))
+    retriever = HistoryRetriever(
+        index,
+        embedder,
+        batch_size=int(os.getenv("RETRIEVAL_BATCH_SIZE", "64")),
+        min_score=float(os.getenv("RETRIEVAL_MIN_SCORE", "0.2")),
+    )
+    if os.getenv("RETRIEVAL_BACKFILL_ARCHIVE"):
+        retriever.backfill(os.environ["RETRIEVAL_BACKFILL_ARCHIVE"])
+    return retriever
@@ -0,0 +1,68 @@
+import json
+import os
+import re
+
+
+class RollingSummary:
+    def __init__(self, summary="", watermark_id=0, updates_since_compaction=0):
+        self.summary = summary
+        self.watermark_id = watermark_id  # newest message id already in the summary
+        self.updates_since_compaction = updates_since_compaction
+
+    def delta(self, msg_list):
+        # messages newer than the watermark, oldest first
+        return sorted((msg for msg in msg_list if msg.id > self.watermark_id), key=lambda msg: msg.id)
+
+    def build_prompt(self, delta_history):
+        if not self.summary:
+            return "Please summarize the chat history." + delta_history
+        return (
+            "Please update the summary of the chat history with the new messages.\n"
+            f"Summary so far: {self.summary}\n"
+            f"New messages:\n{delta_history}"
+        )
+
+    def advance(self, summary, delta):
+        self.summary = summary
+        self.watermark_id = max(self.watermark_id, delta[-1].id)
+        self.updates_since_compaction += 1
+
+
+class RollingSummaryStore:
+    """Per-channel running summaries persisted as json files.
+
+    Each run only feeds the agents the messages after the channel's watermark
+    plus the previous summary, so the prompt stays about the same size as the
+    channel grows. After compact_every updates the summary is due to be
+    condensed again, see needs_compaction.
+    """
+
+    def __init__(self, path_dir="./tmp/rolling_summaries", compact_every=10):
+        self.path_dir = path_dir
+        self.compact_every = compact_every
+        os.makedirs(path_dir, exist_ok=True)
+
+    def _path(self, channel_key):
+        # channel_key is the channel id, names change and can collide
+        return os.path.join(self.path_dir, re.sub(r"[^\w.-]", "_", str(channel_key)) + ".json")
+
+    def load(self, channel_key):
+        try:
+            with open(self._path(channel_key)) as f:
+                return RollingSummary(**json.load(f))
+        except FileNotFoundError:
+            return RollingSummary()
+
+    def save(self, channel_key, state):
+        path = self._path(channel_key)
+        with open(path + ".tmp", "w") as f:
+            json.dump(vars(state), f)
+        os.replace(path + ".tmp", path)  # never leave a half written summary
+
+    def needs_compaction(self, state):
+        return state.updates_since_compaction >= self.compact_every
+
+    def compacted(self, state, summary):
+        state.summary = summary
+        state.updates_since_compaction = 0
+        return state
@@ -0,0 +1,115 @@
+import json
+import os
+
+# Which channels the bots watch, where the private bot posts about them and
+# which pipeline it runs. Loaded from the json file in ROUTING_CONFIG:
+#
+# {
+#   "routes": [
+#     {"source_guild": 111, "source_channel": 222, "destination_channel": 333, "pipeline": "founder_reply"},
+#     {"source_guild": 111, "destination_name": "general", "pipeline": "analysis", "worker": 1}
+#   ],
+#   "default": {"destination_name": "general"}
+# }
+#
+# A route without source_channel covers the whole guild. destination_channel
+# is a channel id, destination_name a channel name for setups without ids.
+# worker pins the guild to a private worker, see PRIVATE_WORKERS in main.py.
+# Without ROUTING_CONFIG every channel is routed to the channel named 'general'.
+
+PIPELINE_FOUNDER_REPLY = "founder_reply"  # rolling summary, founder reply
+PIPELINE_ANALYSIS = "analysis"  # business theme analysis of the packed history, posted as is
+PIPELINES = (PIPELINE_FOUNDER_REPLY, PIPELINE_ANALYSIS)
+
+
+def _id(value):
+    # ids may be written as strings, json numbers lose nothing below 2**53 either way
+    return int(value) if value is not None else None
+
+
+class Route:
+    __slots__ = ("source_guild", "source_channel", "destination_channel", "destination_name", "pipeline", "worker")
+
+    def __init__(self, source_guild=None, source_channel=None, destination_channel=None,
+                 destination_name=None, pipeline=PIPELINE_FOUNDER_REPLY, worker=None):
+        if pipeline not in PIPELINES:
+            raise ValueError(f"unknown pipeline: {pipeline}")
+        if destination_channel is None and destination_name is None:
+            raise ValueError("a route needs destination_channel or destination_name")
+        self.source_guild = _id(source_guild)
+        self.source_channel = _id(source_channel)
+        self.destination_channel = _id(destination_channel)
+        self.destination_name = destination_name
+        self.pipeline = pipeline
+        self.worker = worker
+
+    def __repr__(self):
+        return (f"Route({self.source_guild}/{self.source_channel} -> "
+                f"{self.destination_channel or self.destination_name}, {self.pipeline})")
+
+
+class RoutingTable:
+    """Maps source guild/channel ids to a destination channel and a pipeline.
+
+    route_for() is two dict lookups: the exact (guild, channel) route, then the
+    guild-wide one, then the default. Destination channels are resolved to
+    channel objects by refresh(), once at startup and again on guild and
+    channel gateway events, never per message.
+    """
+
+    def __init__(self, routes, default=None):
+        self.default = default
+        self._routes = {(route.source_guild, route.source_channel): route for route in routes}
+        self._destinations = {}  # route -> channel
+
+    def routes(self):
+        routes = list(self._routes.values())
+        if self.default is not None:
+            routes.append(self.default)
+        return routes
+
+    def route_for(self, guild_id, channel_id):
+        return self._routes.get((guild_id, channel_id)) or self._routes.get((guild_id, None)) or self.default
+
+    def refresh(self, client):
+        by_name = None
+        destinations = {}
+        for route in self.routes():
+            if route.destination_channel is not None:
+                channel = client.get_channel(route.destination_channel)
+            else:
+                if by_name is None:
+                    by_name = {}
+                    for guild in client.guilds:
+                        for channel in guild.text_channels:
+                            by_name.setdefault(channel.name, channel)
+                channel = by_name.get(route.destination_name)
+            if channel is not None:
+                destinations[route] = channel
+        self._destinations = destinations
+        return len(destinations)
+
+    def destination(self, route):
+        return self._destinations.get(route)
+
+    def worker_for(self, guild_id, channel_id, workers):
+        # all channels of a guild go to the same private worker, unless pinned
+        route = self.route_for(guild_id, channel_id)
+        if route is not None and route.worker is not None:
+            return route.worker % workers
+        return guild_id % workers
+
+
+def load_routing(path):
+    with open(path) as f:
+        config = json.load(f)
+    routes = [Route(**route) for route in config.get("routes", [])]
+    default = Route(**config["default"]) if config.get("default") else None
+    return RoutingTable(routes, default)
+
+
+def routing_from_env():
+    path = os.getenv("ROUTING_CONFIG")
+    if not path:
+        return RoutingTable([], default=Route(destination_name="general"))
+    return load_routing(path)
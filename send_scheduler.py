@@ -0,0 +1,250 @@
+import asyncio
+import logging
+import os
+import random
+import time
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE_LENGTH = 2000  # Discord's limit per message
+FENCE = "```"
+
+
+def _hard_split(text, limit):
+    # cuts at the last newline that fits, else between words, else anywhere
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit + 1)
+        if cut > 0:
+            # the next line keeps its indentation
+            chunks.append(text[:cut])
+            text = text[cut + 1:]
+            continue
+        cut = text.rfind(" ", 0, limit + 1)
+        if cut > 0 and text[:cut].strip():
+            chunks.append(text[:cut].rstrip(" "))
+            text = text[cut:].lstrip(" ")
+            continue
+        chunks.append(text[:limit])
+        text = text[limit:]
+    if text:
+        chunks.append(text)
+    return chunks
+
+
+def _split_code_block(block, limit):
+    # an oversized code block is cut on lines, every piece is fenced again
+    lines = block.split("\n")
+    opening = lines[0]  # ``` plus the language, if any
+    body = "\n".join(lines[1:-1] if _is_fence(lines[-1]) and len(lines) > 1 else lines[1:])
+    room = limit - len(opening) - len(FENCE) - 2
+    return [f"{opening}\n{piece}\n{FENCE}" for piece in _hard_split(body, room)]
+
+
+def _is_fence(line):
+    # a line opening or closing a code block; ```inline``` spans are text
+    line = line.strip()
+    return line.startswith(FENCE) and FENCE not in line[len(FENCE):]
+
+
+def _blocks(content):
+    # paragraphs outside code fences and whole fenced blocks; blank lines stay
+    # with the block before them, so the blocks joined give back content
+    blocks = []
+    current = ""
+    in_code = False
+    after_break = False
+    for line in content.splitlines(keepends=True):
+        fence = _is_fence(line)
+        if in_code:
+            current += line
+            if fence:
+                in_code = False
+                after_break = True
+            continue
+        if not line.strip():
+            current += line
+            after_break = True
+            continue
+        if current.strip() and (after_break or fence):
+            blocks.append(current)
+            current = ""
+        current += line
+        in_code = fence
+        after_break = False
+    if current:
+        blocks.append(current)
+    return blocks
+
+
+def split_message(content, limit=MAX_MESSAGE_LENGTH):
+    """Splits content into messages of at most limit characters.
+
+    Cuts between paragraphs and never inside a code block, unless a single
+    paragraph or code block is too long on its own. The text between two cuts
+    is kept as written, whitespace is only trimmed at the cuts.
+    """
+    if len(content) <= limit:
+        return [content]
+    chunks = []
+    current = ""
+    for block in _blocks(content):
+        if len((current + block).rstrip()) <= limit:
+            current += block
+            continue
+        if current.strip():
+            chunks.append(current.rstrip())
+        text = block.rstrip()
+        if len(text) > limit:
+            pieces = _split_code_block(text, limit) if _is_fence(text.split("\n", 1)[0]) else _hard_split(text, limit)
+            chunks.extend(pieces[:-1])
+            text = pieces[-1]
+        # the next block is joined with the separator it had
+        current = text + block[len(block.rstrip()):]
+    if current.strip():
+        chunks.append(current.rstrip())
+    return chunks
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def is_retryable(error):
+    # discord.HTTPException carries the status, 429 is a rate limit
+    status = getattr(error, "status", None)
+    return status == 429 or (status is not None and status >= 500) or type(error).__name__ == "RateLimited"
+
+
+class _Pending:
+    __slots__ = ("content", "future", "queued_at")
+
+    def __init__(self, content, future):
+        self.content = content
+        self.future = future
+        self.queued_at = time.perf_counter()
+
+
+class SendScheduler:
+    """Queues outgoing messages per channel and paces them.
+
+    Each channel has its own queue and token bucket, all channels share a
+    global bucket. Notices that are waiting for the same channel are sent
+    together, then split into messages of at most 2000 characters. A send
+    that fails with a rate limit or a server error is retried after the
+    retry_after Discord gives (or an exponential backoff) plus jitter.
+    """
+
+    def __init__(self, rate=1.0, burst=5, global_rate=40.0, max_retries=5, coalesce=True):
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.coalesce = coalesce
+        self._global = TokenBucket(global_rate, global_rate)
+        self._queues = {}  # channel id -> list of _Pending
+        self._buckets = {}  # channel id -> TokenBucket
+        self._workers = {}  # channel id -> task
+
+    @property
+    def pending(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def send(self, channel, content):
+        """Queues content for channel, the future resolves once it is sent."""
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(channel.id, []).append(_Pending(content, future))
+        if channel.id not in self._workers:
+            self._workers[channel.id] = asyncio.create_task(self._drain(channel))
+        return future
+
+    async def flush(self):
+        while self._workers:
+            await asyncio.gather(*self._workers.values(), return_exceptions=True)
+
+    async def close(self):
+        for task in self._workers.values():
+            task.cancel()
+        await asyncio.gather(*self._workers.values(), return_exceptions=True)
+        self._workers.clear()
+
+    async def _drain(self, channel):
+        bucket = self._buckets.get(channel.id)
+        if bucket is None:
+            bucket = self._buckets[channel.id] = TokenBucket(self.rate, self.burst)
+        queue = self._queues[channel.id]
+        try:
+            while queue:
+                if self.coalesce:
+                    batch = queue[:]
+                    del queue[:]
+                else:
+                    batch = [queue.pop(0)]
+                if len(batch) > 1:
+                    metrics.count("send_coalesced", len(batch) - 1)
+                await self._deliver(channel, bucket, batch)
+        finally:
+            del self._workers[channel.id]
+            if not queue:
+                del self._queues[channel.id]
+
+    async def _deliver(self, channel, bucket, batch):
+        chunks = split_message("\n\n".join(pending.content for pending in batch))
+        sent = []
+        try:
+            for chunk in chunks:
+                await bucket.acquire()
+                await self._global.acquire()
+                sent.append(await self._send_with_retry(channel, chunk))
+        except Exception as e:
+            logger.error("giving up sending to channel", extra={"channel": channel.id, "error": str(e)})
+            for pending in batch:
+                if not pending.future.done():
+                    pending.future.set_exception(e)
+            return
+        metrics.count("send_chunks", len(chunks))
+        now = time.perf_counter()
+        for pending in batch:
+            metrics.observe("send_latency", now - pending.queued_at)
+            if not pending.future.done():
+                pending.future.set_result(sent)
+
+    async def _send_with_retry(self, channel, chunk):
+        backoff = 1.0
+        for attempt in range(self.max_retries + 1):
+            try:
+                with metrics.time("reply_send"):
+                    return await channel.send(chunk)
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    raise
+                delay = getattr(e, "retry_after", None) or backoff
+                backoff = min(backoff * 2, 60.0)
+                metrics.count("send_retries")
+                logger.warning("send rate limited, retrying", extra={"channel": channel.id, "retry_in": delay})
+                await asyncio.sleep(delay + random.uniform(0, delay * 0.25))
+
+
+def scheduler_from_env():
+    return SendScheduler(
+        rate=float(os.getenv("SEND_RATE_PER_CHANNEL", "1")),
+        burst=int(os.getenv("SEND_BURST", "5")),
+        global_rate=float(os.getenv("SEND_GLOBAL_RATE", "40")),
+        max_retries=int(os.getenv("SEND_MAX_RETRIES", "5")),
+        coalesce=os.getenv("SEND_COALESCE", "1") == "1",
+    )
@@ -0,0 +1,95 @@
+import asyncio
+import contextlib
+import logging
+import os
+import threading
+import time
+
+from metrics import instrument_agent
+
+logger = logging.getLogger(__name__)
+
+
+class WarmTeachability:
+    """Teachability whose vector db is loaded in the background.
+
+    Loading the ChromaDB store and the embedding model takes tens of seconds.
+    warm_up() does that in a worker thread and only then attaches the
+    capability to the agent, so requests that come in before are answered
+    without memo recall instead of waiting. The db is kept across restarts
+    unless reset_db is set.
+    """
+
+    def __init__(self, path_to_db_dir="./tmp/notebook/teachability_db", reset_db=False, verbosity=0, recall_threshold=1.5):
+        self.path_to_db_dir = path_to_db_dir
+        self.reset_db = reset_db
+        self.verbosity = verbosity
+        self.recall_threshold = recall_threshold
+        self.teachability = None
+        self.warm_seconds = None
+        self.error = None  # why warm_up failed, replies then go on without recall
+        self.ready = asyncio.Event()
+
+    @property
+    def is_ready(self):
+        return self.ready.is_set()
+
+    def _load(self, agent, agent_lock):
+        from autogen.agentchat.contrib.capabilities.teachability import Teachability
+
+        start = time.perf_counter()
+        teachability = Teachability(
+            verbosity=self.verbosity,  # 0 for basic info, 1 to add memory operations, 2 for analyzer messages, 3 for memo lists.
+            reset_db=self.reset_db,
+            path_to_db_dir=self.path_to_db_dir,
+            recall_threshold=self.recall_threshold,  # Higher numbers allow more (but less relevant) memos to be recalled.
+        )
+        # the first embedding loads the model. A query would not do it: on an
+        # empty store get_related_memos never embeds anything.
+        embed = getattr(teachability.memo_store.vec_db, "_embedding_function", None)
+        if embed is not None:
+            embed(["warm up"])
+        with agent_lock:  # never change the agent's hooks during a chat
+            teachability.add_to_agent(agent)
+        # its memo analysis calls count as LLM calls of the event too
+        instrument_agent(teachability.analyzer)
+        self.teachability = teachability
+        self.warm_seconds = time.perf_counter() - start
+
+    @contextlib.contextmanager
+    def suspended(self, agent):
+        """Detaches the recall and memo hook from agent inside the block.
+
+        The caller holds the agent's lock, the hook is back when it leaves.
+        """
+        hooks = agent.hook_lists["process_last_received_message"] if hasattr(agent, "hook_lists") else []
+        hook = self.teachability.process_last_received_message if self.teachability is not None else None
+        if hook is None or hook not in hooks:
+            yield
+            return
+        hooks.remove(hook)
+        try:
+            yield
+        finally:
+            hooks.append(hook)
+
+    async def warm_up(self, agent, agent_lock=None):
+        if self.is_ready:
+            return
+        try:
+            await asyncio.to_thread(self._load, agent, agent_lock or threading.Lock())
+        except Exception as e:
+            self.error = e
+            logger.exception("teachability warm-up failed, replying without memo recall")
+        else:
+            logger.info(f"teachability ready after {self.warm_seconds:.1f}s")
+        finally:
+            # set in any case, replies waiting for it must not wait forever
+            self.ready.set()
+
+
+def teachability_from_env():
+    return WarmTeachability(
+        path_to_db_dir=os.getenv("TEACHABILITY_DB_DIR", "./tmp/notebook/teachability_db"),
+        reset_db=os.getenv("TEACHABILITY_RESET", "0") == "1",
+    )
@@ -0,0 +1,60 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from archive import ArchiveReader, write_archive
+from data_definition import MessageRecord
+
+
+def sample_messages():
+    return [
+        MessageRecord(30, "bob", "merci, ça marche", "2025-01-01 00:00:03+00:00", 1, 10, "guild_general",
+                      is_reply=True, reply_to_message_id=10, original_thread_id=10),
+        MessageRecord(10, "amy", "how do I reset it?", "2025-01-01 00:00:01+00:00", 1, 10, "guild_general",
+                      original_thread_id=10),
+        MessageRecord(20, "rudy-bot", "", "2025-01-01 00:00:02.500000+00:00", 1, 10, "guild_general",
+                      author_is_bot=True, original_thread_id=20),
+    ]
+
+
+def test_round_trip_keeps_every_field(tmp_path):
+    path = tmp_path / "history.dcha"
+    assert write_archive(path, sample_messages()) == 3
+    with ArchiveReader(path) as reader:
+        assert len(reader) == 3
+        msgs = list(reader)
+    assert [msg.id for msg in msgs] == [10, 20, 30]  # oldest first
+    by_id = {msg.id: msg for msg in sample_messages()}
+    for msg in msgs:
+        expected = by_id[msg.id]
+        for field in ("author", "content", "guild_id", "channel_id", "guild_channel", "is_reply",
+                      "author_is_bot", "reply_to_message_id", "original_thread_id"):
+            assert msg[field] == expected[field], field
+        assert datetime.fromisoformat(msg.timestamp) == datetime.fromisoformat(expected.timestamp)
+
+
+def test_lookups_by_id_time_and_thread(tmp_path):
+    path = tmp_path / "history.dcha"
+    write_archive(path, sample_messages())
+    with ArchiveReader(path) as reader:
+        assert reader.get(20).author == "rudy-bot"
+        assert reader.get(25) is None
+        start = datetime(2025, 1, 1, 0, 0, 2, tzinfo=timezone.utc)
+        assert [msg.id for msg in reader.time_range(start=start)] == [20, 30]
+        assert [msg.id for msg in reader.time_range(end=start)] == [10]
+        assert [msg.id for msg in reader.thread(10)] == [10, 30]
+
+
+def test_empty_archive(tmp_path):
+    path = tmp_path / "empty.dcha"
+    assert write_archive(path, []) == 0
+    with ArchiveReader(path) as reader:
+        assert list(reader) == []
+        assert reader.get(1) is None
+
+
+def test_other_files_are_refused(tmp_path):
+    path = tmp_path / "history.json"
+    path.write_bytes(b"[]" + b"\0" * 512)
+    with pytest.raises(ValueError):
+        ArchiveReader(path)
@@ -0,0 +1,74 @@
+import asyncio
+import os
+
+import pytest
+
+import ipc
+from data_definition import MessageHistory, MessageRecord
+from logging_setup import correlation_id
+
+
+def sample_history():
+    return MessageHistory([
+        MessageRecord(2, "bob", "a reply", "2025-01-01 00:00:01+00:00", 1, 10, "guild_general",
+                      is_reply=True, reply_to_message_id=1, original_thread_id=1),
+        MessageRecord(1, "amy", "a question?", "2025-01-01 00:00:00+00:00", 1, 10, "guild_general",
+                      original_thread_id=1),
+    ])
+
+
+def test_frame_round_trip_keeps_history_and_correlation_id():
+    correlation_id.set("1234")
+    frame = ipc.encode_message(sample_history())
+    (size,) = ipc.FRAME_HEADER.unpack(frame[:ipc.FRAME_HEADER.size])
+    assert size == len(frame) - ipc.FRAME_HEADER.size
+
+    correlation_id.set(None)
+    history = ipc.decode_message(frame[ipc.FRAME_HEADER.size:])
+    assert correlation_id.get() == "1234"
+    assert [msg.id for msg in history.msg_list] == [2, 1]
+    assert history.msg_dict[2].reply_to_message_id == 1
+    assert history.msg_list[1].content == "a question?"
+
+
+def test_plain_json_round_trip():
+    frame = ipc.encode_message({"response": "hi"})
+    assert ipc.decode_message(frame[ipc.FRAME_HEADER.size:]) == {"response": "hi"}
+
+
+def test_oversized_frame_is_refused(monkeypatch):
+    monkeypatch.setattr(ipc, "MAX_FRAME_SIZE", 64)
+    with pytest.raises(ValueError):
+        ipc.encode_message("x" * 100)
+
+
+def test_reader_reads_frames_back_to_back(tmp_path):
+    async def scenario():
+        pipe = str(tmp_path / "pipe")
+        reader = await ipc.PipeReader(pipe).open()
+        writer = ipc.PipeWriter(pipe).start()
+        for i in range(3):
+            await writer.send({"n": i})
+        received = [await asyncio.wait_for(reader.recv(), 2) for _ in range(3)]
+        await writer.close()
+        reader.close()
+        return received
+
+    assert asyncio.run(scenario()) == [{"n": 0}, {"n": 1}, {"n": 2}]
+
+
+def test_reader_resyncs_after_a_corrupt_header(tmp_path):
+    async def scenario():
+        pipe = str(tmp_path / "pipe")
+        reader = await ipc.PipeReader(pipe).open()
+        fd = os.open(pipe, os.O_WRONLY | os.O_NONBLOCK)
+        os.write(fd, ipc.FRAME_HEADER.pack(ipc.MAX_FRAME_SIZE + 1) + b"garbage" * 8)
+        with pytest.raises(ValueError):
+            await asyncio.wait_for(reader.recv(), 2)
+        os.write(fd, ipc.encode_message({"ok": True}))
+        message = await asyncio.wait_for(reader.recv(), 2)
+        os.close(fd)
+        reader.close()
+        return message
+
+    assert asyncio.run(scenario()) == {"ok": True}
@@ -0,0 +1,39 @@
+import asyncio
+from types import SimpleNamespace
+
+from progress_message import ProgressMessage
+
+
+class FakeMessage:
+    def __init__(self, log):
+        self.log = log
+
+    async def edit(self, content):
+        await asyncio.sleep(0.01)
+        self.log.append(("edit", content))
+
+
+class FakeFollowup:
+    def __init__(self, log):
+        self.log = log
+
+    async def send(self, content, wait=False):
+        self.log.append(("send", content))
+        return FakeMessage(self.log)
+
+
+def test_updates_after_finish_are_ignored():
+    log = []
+
+    async def run():
+        progress = await ProgressMessage(SimpleNamespace(followup=FakeFollowup(log)), min_interval=0).start("working")
+        progress.update("partial")
+        await asyncio.sleep(0.005)  # the partial edit is in flight
+        await progress.finish("done")
+        asyncio.get_running_loop().call_soon_threadsafe(progress.update, "late partial")
+        await asyncio.sleep(0.05)
+
+    asyncio.run(run())
+    assert log[0] == ("send", "working")
+    assert log[-1] == ("edit", "done")
+    assert ("edit", "late partial") not in log
@@ -0,0 +1,56 @@
+from send_scheduler import split_message
+
+
+def test_short_message_is_kept_whole():
+    assert split_message("hello\n\nworld", limit=100) == ["hello\n\nworld"]
+
+
+def test_cuts_between_paragraphs_and_keeps_the_separators():
+    content = "line one\nline two\n\n" + "x" * 30 + "\n\nlast"
+    chunks = split_message(content, limit=40)
+    assert chunks == ["line one\nline two", "x" * 30 + "\n\nlast"]
+
+
+def test_code_block_is_not_surrounded_by_blank_lines():
+    content = "intro\n```py\nprint(1)\n```\nafter\n\n" + "y" * 30
+    chunks = split_message(content, limit=40)
+    assert chunks == ["intro\n```py\nprint(1)\n```\nafter", "y" * 30]
+
+
+def test_blank_lines_inside_a_code_block_do_not_cut_it():
+    block = "```\na = 1\n\nb = 2\n```"
+    chunks = split_message("z" * 30 + "\n\n" + block, limit=40)
+    assert chunks == ["z" * 30, block]
+
+
+def test_inline_code_span_stays_in_its_paragraph():
+    content = "use ```x``` here\nnext line\n\n" + "w" * 30
+    chunks = split_message(content, limit=40)
+    assert chunks == ["use ```x``` here\nnext line", "w" * 30]
+
+
+def test_oversized_code_block_is_fenced_again_and_keeps_indentation():
+    lines = [f"    line_{i} = {i}" for i in range(20)]
+    content = "```py\n" + "\n".join(lines) + "\n```"
+    chunks = split_message(content, limit=80)
+    assert len(chunks) > 1
+    body = []
+    for chunk in chunks:
+        assert len(chunk) <= 80
+        assert chunk.startswith("```py\n") and chunk.endswith("\n```")
+        body.extend(chunk[len("```py\n"):-len("\n```")].split("\n"))
+    assert body == lines
+
+
+def test_long_paragraph_is_cut_between_words():
+    words = [f"word{i}" for i in range(100)]
+    chunks = split_message(" ".join(words), limit=50)
+    for chunk in chunks:
+        assert len(chunk) <= 50
+        assert chunk == chunk.strip()
+    assert " ".join(chunks).split(" ") == words
+
+
+def test_text_without_breaks_is_cut_at_the_limit():
+    chunks = split_message("a" * 95, limit=40)
+    assert chunks == ["a" * 40, "a" * 40, "a" * 15]
@@ -0,0 +1,31 @@
+from thread_index import ReplyGraphIndex
+
+
+def test_forward_references_resolve_once_the_parent_arrives():
+    index = ReplyGraphIndex()
+    index.add(3, 2)  # newest first, like channel.history()
+    index.add(2, 1)
+    assert index.root(3) == 1
+    assert not index.is_resolved(3)
+    index.add(1)
+    assert index.root(3) == 1
+    assert index.is_resolved(3)
+
+
+def test_compact_keeps_resolved_threads_resolved():
+    index = ReplyGraphIndex()
+    index.add(1)
+    index.add(2, 1)
+    index.add(3, 2)
+    index.compact([3])
+    assert index.root(3) == 1
+    assert index.is_resolved(3)
+    assert len(index) == 2
+
+
+def test_compact_keeps_unknown_roots_unresolved():
+    index = ReplyGraphIndex()
+    index.add(5, 4)
+    index.compact([5])
+    assert index.root(5) == 4
+    assert not index.is_resolved(5)
@@ -0,0 +1,21 @@
+from types import SimpleNamespace
+
+from triage import Triage
+
+
+def message(content):
+    return SimpleNamespace(content=content, mentions=[])
+
+
+def test_keywords_match_whole_words_only():
+    triage = Triage(keywords=["deploy"], threshold=0.1)
+    assert triage.evaluate(message("can we Deploy today?")).forward
+    assert not triage.evaluate(message("redeployment is done")).forward
+
+
+def test_keywords_ending_in_punctuation_match():
+    triage = Triage(keywords=["c++", ".net", "help!"], threshold=0.1)
+    assert triage.evaluate(message("anyone good at C++ here")).forward
+    assert triage.evaluate(message("ported to .net")).forward
+    assert triage.evaluate(message("help!")).forward
+    assert not triage.evaluate(message("asp.netcore")).forward
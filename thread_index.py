@@ -0,0 +1,69 @@
+class ReplyGraphIndex:
+    """Reply graph of a channel, mapping every message to its thread root.
+
+    Messages can be added in any order. A reply whose parent is not known yet
+    points at the parent id; once the parent (or an older ancestor) is added,
+    lookups continue through it, so forward references resolve by themselves.
+    root() follows parent pointers with path compression (union-find), which
+    makes repeated lookups effectively constant time.
+    """
+
+    def __init__(self):
+        self._parent = {}  # message id -> replied-to message id, None for a thread start
+
+    def __len__(self):
+        return len(self._parent)
+
+    def __contains__(self, message_id):
+        return message_id in self._parent
+
+    def add(self, message_id, reply_to_id=None):
+        self._parent[message_id] = reply_to_id
+
+    def root(self, message_id):
+        # walk up to the oldest known ancestor, a message that is not a reply or
+        # whose parent was never seen (outside of the downloaded window)
+        root = message_id
+        path = []
+        while True:
+            parent = self._parent.get(root)
+            if parent is None:
+                break
+            path.append(root)
+            root = parent
+        for node in path[:-1]:
+            self._parent[node] = root
+        return root
+
+    def is_resolved(self, message_id):
+        # True if the root is a known thread start, not a message we never saw
+        return self._parent.get(self.root(message_id), 0) is None
+
+    def compact(self, keep_ids):
+        # drop every message but keep_ids, pointing them straight at their roots.
+        # Known roots stay as thread starts, so is_resolved() still holds.
+        parent = {}
+        for message_id in keep_ids:
+            root = self.root(message_id)
+            parent[message_id] = None if root == message_id else root
+            if root in self._parent:
+                parent[root] = None
+        self._parent = parent
+
+
+def resolve_thread_ids(msg_list, thread_index):
+    for msg in msg_list:
+        msg.original_thread_id = thread_index.root(msg.id)
+    return msg_list
+
+
+def group_by_thread(msg_list):
+    """Thread root id -> the thread's messages, oldest first.
+
+    Threads are ordered by their oldest message in msg_list. Needs
+    original_thread_id to be resolved, see resolve_thread_ids.
+    """
+    threads = {}
+    for msg in sorted(msg_list, key=lambda msg: msg.id):
+        threads.setdefault(msg.original_thread_id, []).append(msg)
+    return threads
@@ -0,0 +1,119 @@
+import os
+import re
+
+from embeddings import HashingEmbedder, cosine
+from metrics import metrics
+
+# A cheap local decision, per gateway message, whether the message is worth
+# the swarm and the founder reply. Scores add up:
+#   mention of the bot or a founder (message.mentions)  TRIAGE_MENTION_WEIGHT
+#   one of the keywords                                 TRIAGE_KEYWORD_WEIGHT
+#   one of the regex patterns                           TRIAGE_PATTERN_WEIGHT
+#   similarity to the "needs reply" examples           TRIAGE_SIMILARITY_WEIGHT * cosine
+# and the message is forwarded when the sum reaches TRIAGE_THRESHOLD.
+
+
+class TriageDecision:
+    __slots__ = ("score", "reasons", "forward")
+
+    def __init__(self, score, reasons, forward):
+        self.score = score
+        self.reasons = reasons
+        self.forward = forward
+
+    def __repr__(self):
+        return f"TriageDecision(score={self.score:.2f}, reasons={self.reasons}, forward={self.forward})"
+
+
+class Triage:
+    """Scores messages with mentions, keyword and regex rules and example similarity.
+
+    All rules are compiled once: the keywords into one alternation, the
+    patterns each, the examples into embeddings.
+    """
+
+    def __init__(self, keywords=(), patterns=(), founders=(), examples=(), threshold=0.5,
+                 mention_weight=1.0, keyword_weight=0.5, pattern_weight=0.5, similarity_weight=1.0,
+                 embedder=None):
+        self.threshold = threshold
+        self.mention_weight = mention_weight
+        self.keyword_weight = keyword_weight
+        self.pattern_weight = pattern_weight
+        self.similarity_weight = similarity_weight
+        self.founders = {founder.lower() for founder in founders}
+        self.keywords = None
+        if keywords:
+            alternation = "|".join(re.escape(keyword) for keyword in keywords)
+            self.keywords = re.compile(rf"(?<!\w)(?:{alternation})(?!\w)", re.IGNORECASE)
+        self.patterns = [re.compile(pattern, re.IGNORECASE) for pattern in patterns]
+        self.embedder = None
+        self.examples = []
+        if examples:
+            self.embedder = embedder or HashingEmbedder()
+            self.examples = self.embedder.embed(list(examples))
+        self.decisions = {"forwarded": 0, "dropped": 0}
+
+    def is_mentioned(self, message, bot_user):
+        for user in message.mentions:
+            if user == bot_user or user.name.lower() in self.founders:
+                return True
+        return False
+
+    def similarity(self, content):
+        if not self.examples:
+            return 0.0
+        (vector,) = self.embedder.embed([content])
+        return max(cosine(vector, example) for example in self.examples)
+
+    def evaluate(self, message, bot_user=None):
+        score = 0.0
+        reasons = []
+        if self.is_mentioned(message, bot_user):
+            score += self.mention_weight
+            reasons.append("mention")
+        if self.keywords is not None and self.keywords.search(message.content):
+            score += self.keyword_weight
+            reasons.append("keyword")
+        if any(pattern.search(message.content) for pattern in self.patterns):
+            score += self.pattern_weight
+            reasons.append("pattern")
+        # the embedding is the most expensive rule, skip it once the decision is made
+        if score < self.threshold and self.examples:
+            similarity = self.similarity(message.content)
+            if similarity > 0:
+                score += self.similarity_weight * similarity
+                reasons.append(f"similarity={similarity:.2f}")
+        forward = score >= self.threshold
+        outcome = "forwarded" if forward else "dropped"
+        self.decisions[outcome] += 1
+        metrics.count(f"triage_{outcome}")
+        for reason in reasons:
+            metrics.count(f"triage_reason_{reason.split('=')[0]}")
+        return TriageDecision(score, reasons, forward)
+
+
+def _list_from_env(name, separator=","):
+    return [item.strip() for item in os.getenv(name, "").split(separator) if item.strip()]
+
+
+def triage_from_env():
+    """The configured Triage, or None when TRIAGE_ENABLED is not 1 (everything is forwarded)."""
+    if os.getenv("TRIAGE_ENABLED", "0") != "1":
+        return None
+    examples = []
+    if os.getenv("TRIAGE_EXAMPLES"):
+        # one "needs reply" example message per line
+        with open(os.environ["TRIAGE_EXAMPLES"]) as f:
+            examples = [line.strip() for line in f if line.strip()]
+    return Triage(
+        keywords=_list_from_env("TRIAGE_KEYWORDS"),
+        # patterns may contain commas, they are separated by ;;
+        patterns=_list_from_env("TRIAGE_PATTERNS", ";;"),
+        founders=_list_from_env("TRIAGE_FOUNDERS"),
+        examples=examples,
+        threshold=float(os.getenv("TRIAGE_THRESHOLD", "0.5")),
+        mention_weight=float(os.getenv("TRIAGE_MENTION_WEIGHT", "1.0")),
+        keyword_weight=float(os.getenv("TRIAGE_KEYWORD_WEIGHT", "0.5")),
+        pattern_weight=float(os.getenv("TRIAGE_PATTERN_WEIGHT", "0.5")),
+        similarity_weight=float(os.getenv("TRIAGE_SIMILARITY_WEIGHT", "1.0")),
+    )
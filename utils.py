@@ -1,22 +1,9 @@
 import discord
-import pickle
-import asyncio
+import logging
+from data_definition import MessageRecord
+from thread_index import ReplyGraphIndex, resolve_thread_ids
 
-async def async_pickle_load(pipe_name):
-    def load_pickle():
-        with open(pipe_name, "rb") as pipe:
-            return pickle.load(pipe)  # Blocking call
-
-    return await asyncio.to_thread(load_pickle)  # Run in a separate thread
-
-
-# not working
-#with open(pipe_name_private_to_public, "rb") as pipe:
-#               print(f"pipe opened server: {pipe}")
-#              message_data = await async_pickle_load2(pipe)
-async def async_pickle_load2(pipe):
-    """Runs pickle.load() asynchronously using a separate thread."""
-    return await asyncio.to_thread(pickle.load, pipe)  # Non-blocking
+logger = logging.getLogger(__name__)
 
 # Not Tested yet
 async def download_guild_history_by_name(client, guild_name, channel_name, limit=2):
@@ -31,17 +18,40 @@ async def download_guild_history_raw_by_name(client, guild_name, channel_name, l
 
     msg_list = []
     async for message in channel.history(limit=limit, oldest_first=False):
-        print(f"download_channel_history: message: {message}")
+        logger.debug("downloaded message", extra={"message_id": message.id})
         msg_list.append(message)
     return msg_list
     
 
 
-async def download_channel_history(client, guild, channel, limit=5):
-    print(f"download_channel_history: {guild.name}, {channel.name}")
+def message_to_record(message, guild, channel):
+    reply_to_message_id = message.reference.message_id if message.reference else None
+    return MessageRecord(
+        id=message.id,
+        author=str(message.author),
+        content=message.content,
+        timestamp=str(message.created_at),
+        guild_id=message.guild.id,
+        channel_id=message.channel.id,
+        guild_channel=f"{guild.name}_{channel.name}",
+        is_reply=message.reference is not None,  # Reply if there is a reference
+        author_is_bot=message.author.bot,  # Check if the author is a bot
+        reply_to_message_id=reply_to_message_id,
+        # filled in by resolve_thread_ids once the whole batch is indexed
+        original_thread_id=None if message.reference else message.id,
+    )
+
+
+async def download_channel_history(client, guild, channel, limit=5, cache=None, store=None):
+    logger.debug("download_channel_history", extra={"guild": guild.name, "channel": channel.name})
+    if store is not None:
+        return await download_stored_channel_history(guild, channel, limit, store)
+    if cache is not None:
+        return await download_cached_channel_history(guild, channel, limit, cache)
+
     msg_list = []
     message_dict = {}  # Dictionary to store messages by their IDs
-    replied_to_message_ids = set()  # Set to keep track of message IDs that have replies
+    thread_index = ReplyGraphIndex()
 
     # for tguild in client.guilds:
     #     print(f'Util Guild log: {tguild.name}')
@@ -50,38 +60,79 @@ async def download_channel_history(client, guild, channel, limit=5):
 
 
     async for message in channel.history(limit=limit, oldest_first=False):
-        print(f"download_channel_history: message: {message}")
-        message_data = {
-            "id": str(message.id),
-            "author": str(message.author),
-            "content": message.content,
-            "timestamp": str(message.created_at),
-            "link": f"https://discord.com/channels/{message.guild.id}/{message.channel.id}/{message.id}",
-            "is_thread": message.reference is None,  # Major thread if no reference
-            "is_reply": message.reference is not None,  # Reply if there is a reference
-            "author_is_bot": message.author.bot,  # Check if the author is a bot
-            "guild_channel": f"{guild.name}_{channel.name}"
-        }
-
-
-        if message.reference:
-            message_data["reply_to_message_id"] = message.reference.message_id
-            replied_to_message_ids.add(message.reference.message_id)
-            # Find the original thread
-            original_thread = find_original_thread(message.reference.message_id, message_dict)
-            message_data["original_thread_id"] = original_thread.get("id") if original_thread else None
-        else:
-            message_data["original_thread_id"] = message.id
-
+        logger.debug("downloaded message", extra={"message_id": message.id, "author": str(message.author)})
+        message_data = message_to_record(message, guild, channel)
         msg_list.append(message_data)
         message_dict[message.id] = message_data  # Add message to dictionary
+        thread_index.add(message.id, message_data.reply_to_message_id)
+    # newest first, so most parents were added after their replies
+    resolve_thread_ids(msg_list, thread_index)
     return msg_list, message_dict
 
-def find_original_thread(message_id, message_dict):
-    # Recursively find the original thread by following the chain of references
-    while message_id in message_dict:
-        message = message_dict[message_id]
-        if message["is_thread"]:
-            return message
-        message_id = message.get("reply_to_message_id")
-    return None
\ No newline at end of file
+
+async def download_cached_channel_history(guild, channel, limit, cache):
+    history = cache.get(channel.id)
+    fetched = None
+    if history is not None and history.newest_id is not None and history.seeded_limit >= limit:
+        # only pull what arrived after the newest cached message
+        fetched = []
+        async for message in channel.history(limit=cache.max_messages, after=discord.Object(id=history.newest_id), oldest_first=True):
+            fetched.append(message)
+        if len(fetched) >= cache.max_messages:
+            fetched = None  # too far behind, there may be a gap, seed again
+    if fetched is None:
+        history = cache.seed(channel.id, limit)
+        fetched = []
+        async for message in channel.history(limit=limit, oldest_first=False):
+            fetched.append(message)
+        fetched.reverse()  # add oldest first so reply parents are known
+    logger.debug("fetched new messages", extra={"channel": channel.name, "fetched": len(fetched)})
+
+    for message in fetched:
+        history.add(message_to_record(message, guild, channel))
+
+    msg_list = resolve_thread_ids(history.latest(limit), history.thread_index)
+    message_dict = {message_data.id: message_data for message_data in msg_list}
+    return msg_list, message_dict
+
+
+async def backfill_channel(store, guild, channel, limit=5, max_gap=1000):
+    """Pulls into the store what the channel got while the bot was not listening.
+
+    Pages from the newest stored message on, or the newest limit messages when
+    the channel was never stored or more than max_gap messages behind. A
+    channel the gateway kept current only needs older messages, when limit is
+    larger than what is stored.
+    """
+    newest_id = await store.newest_id(channel.id)
+    fetched = 0
+    reseed = newest_id is None
+    if newest_id is not None and channel.id not in store.synced_channels:
+        async for message in channel.history(limit=max_gap, after=discord.Object(id=newest_id), oldest_first=True):
+            store.ingest(message_to_record(message, guild, channel))
+            fetched += 1
+        if fetched >= max_gap:
+            logger.warning("stored history has a gap", extra={"channel": channel.name})
+            reseed = True
+    if reseed:
+        async for message in channel.history(limit=limit, oldest_first=False):
+            store.ingest(message_to_record(message, guild, channel))
+            fetched += 1
+    else:
+        stored = await store.latest(channel.id, limit)
+        if len(stored) < limit:
+            oldest_id = stored[-1].id
+            async for message in channel.history(limit=limit - len(stored), before=discord.Object(id=oldest_id), oldest_first=False):
+                store.ingest(message_to_record(message, guild, channel))
+                fetched += 1
+    store.synced_channels[channel.id] = max(limit, store.synced_channels.get(channel.id, 0))
+    logger.info("channel backfilled", extra={"channel": channel.name, "fetched": fetched})
+
+
+async def download_stored_channel_history(guild, channel, limit, store):
+    # REST only for a channel not backfilled yet, or for more than was backfilled
+    if store.synced_channels.get(channel.id, 0) < limit:
+        await backfill_channel(store, guild, channel, limit)
+    msg_list = await store.latest(channel.id, limit)
+    message_dict = {message_data.id: message_data for message_data in msg_list}
+    return msg_list, message_dict